@@ -1,20 +1,57 @@
+import ast
+import gzip
+import hashlib
+import importlib
+import inspect
+import io
+import json
+import lzma
+import mmap
 import os
 import pickle
+import pickletools
+import reprlib
+import signal
+import struct
+import sys
+import threading
+import types
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from math import inf
 from pathlib import Path
+from time import perf_counter
+from typing import Union
 
-from IPython.core.magic import register_line_magic
+from IPython.core.magic import register_cell_magic, register_line_magic
+from IPython.paths import get_ipython_dir
 
 
 def load_ipython_extension(ipython):
     print("Loaded extension ipickle")
+    ipython.events.register("post_run_cell", report_finished_saves)
 
     @register_line_magic("ipickle")
     def magic(line: str):
-        """%ipickle <expression> [-o <output>]
+        """%ipickle <expression> [-o <output> [-z <codec>] [--bg]]
 
         `expression` can be a Python expression or a variable, in which case it will be pickled; or a pickle file, in which case it will be unpickled.
         `output` can be a file or a variable name.
         If `output` is specified, the result will be assigned to the variable or written to the file.
+        `-z` writes the file as compressed chunks (codec: gzip, lzma, or zstd if installed); loading detects it.
+        `--bg` writes the file from a forked child while the session goes on (see BackgroundSave).
+
+        %ipickle --session save [-n <session>]
+        %ipickle --session restore [<variable> ...] [-n <session>]
+        %ipickle --session list [-n <session>]
+
+        Snapshots the whole namespace into a content-addressed store (see save_session), or restores all or some of it.
+
+        %ipickle --sizes <expression>
+
+        Pickles into nothing and shows which attribute paths and types the bytes go to (see SizeProfiler).
         """
         import pickle
 
@@ -27,8 +64,23 @@ def load_ipython_extension(ipython):
             return
         arguments: list = expression.split()
         arguments = [os.path.expanduser(arg) for arg in arguments]  # Just in case
+        if arguments[0] == "--session":
+            return process_session(arguments[1:], ipython=ipython)
+        if arguments[0] == "--sizes":
+            return process_sizes(arguments[1:], ipython=ipython)
+        codec = None
+        if "-z" in arguments:
+            codec_argument_index = arguments.index("-z")
+            codec = arguments[codec_argument_index + 1]
+            if codec not in CODECS:
+                raise ValueError(f"unknown codec: {codec!r}. Expecting one of {', '.join(CODECS)}.")
+            arguments.pop(codec_argument_index)
+            arguments.pop(codec_argument_index)
+        background = "--bg" in arguments
+        if background:
+            arguments.remove("--bg")
         if len(arguments) == 1:
-            return process_expression(arguments[0], ipython=ipython)
+            return process_expression(arguments[0], codec=codec, background=background, ipython=ipython)
         if len(arguments) != 3:
             raise ValueError(f"too many arguments: {arguments!r}. Expecting either 1 or 3 arguments.")
 
@@ -36,16 +88,49 @@ def load_ipython_extension(ipython):
         output_argument = arguments[output_argument_index + 1]
         arguments.pop(output_argument_index)
         arguments.pop(output_argument_index)  # Twice to remove both -o and the output argument.
-        return process_expression(arguments[0], output_argument, ipython=ipython)
+        return process_expression(arguments[0], output_argument, codec=codec, background=background, ipython=ipython)
+
+    @register_cell_magic("cache")
+    def cache_magic(line: str, cell: str):
+        """%%cache [--force]
 
+        Runs the cell, or restores the variables it assigns from a previous run with the same source and inputs
+        (see cached_run). `--force` reruns it and refreshes the cache."""
+        return cached_run(cell, force="--force" in line.split(), ipython=ipython)
 
-def process_expression(expression, output=None, *, ipython):
+
+def process_expression(expression, output=None, *, codec=None, background=False, ipython):
     print(f"\x1b[2mexpression: {expression!r} | output: {output!r}\x1b[0m")
+    if (codec is not None or background) and (output is None or not is_file_output(output)):
+        raise ValueError(f"-z and --bg only apply to a file output (-o FILE), got {output!r}.")
     if is_variable_in_namespace(expression, ipython=ipython):
-        return pickle_and_output_variable(expression, output, ipython=ipython)
+        return pickle_and_output_variable(expression, output, codec=codec, background=background, ipython=ipython)
     if is_pickle_file(expression):
+        if codec is not None or background:
+            raise ValueError(f"-z and --bg only apply when pickling, not when loading {expression}.")
         return unpickle_and_output(expression, output, ipython=ipython)
-    return pickle_and_output(expression, output, ipython=ipython)
+    return pickle_and_output(expression, output, codec=codec, background=background, ipython=ipython)
+
+
+def process_session(arguments, *, ipython):
+    session = "default"
+    if "-n" in arguments:
+        session_argument_index = arguments.index("-n")
+        session = arguments[session_argument_index + 1]
+        arguments.pop(session_argument_index)
+        arguments.pop(session_argument_index)
+    action, *names = arguments or ["save"]
+    if action == "save":
+        return save_session(session, ipython=ipython)
+    if action == "restore":
+        return restore_session(session, names or None, ipython=ipython)
+    if action == "list":
+        return list_session(session)
+    raise ValueError(f"unknown session action: {action!r}. Expecting save, restore or list.")
+
+
+def is_file_output(output) -> bool:
+    return os.path.isfile(output) or Path(output).parent.is_dir()
 
 
 def is_variable_in_namespace(var_name, *, ipython):
@@ -53,47 +138,921 @@ def is_variable_in_namespace(var_name, *, ipython):
     return var_name in ipython.user_ns
 
 
+SNIFF_OPCODES = 16
+PROTOCOL = 5
+OUT_OF_BAND_MIN_BYTES = 1024 * 1024
+SIDECAR_SUFFIX = ".buffers"
+SIDECAR_MAGIC = b"ipickle-buffers\x00"
+SIDECAR_ALIGNMENT = mmap.ALLOCATIONGRANULARITY
+
+
 def is_pickle_file(file_path) -> bool:
-    """Check if a file with the given name is a pickle file."""
-    if not os.path.isfile(file_path):
+    """Check if a file with the given name is a pickle file, without loading it:
+    a pickle ends with STOP, and starts with a PROTO header (protocols 2+) or, for protocols 0 and 1,
+    with opcodes that parse. Compressed containers (see CompressedWriter) are recognized by their magic."""
+    if not os.path.isfile(file_path) or os.path.getsize(file_path) < 2:
         return False
-    try:
-        with open(file_path, "rb") as f:
-            pickle.load(f)
+    if is_compressed_pickle_file(file_path):
         return True
-    except Exception:
+    with open(file_path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != pickle.STOP:
+            return False
+        f.seek(0)
+        header = f.read(2)
+        if header[:1] == pickle.PROTO:
+            return 2 <= header[1] <= pickle.HIGHEST_PROTOCOL
+        f.seek(0)
+        try:
+            for i, (opcode, _, _) in enumerate(pickletools.genops(f)):
+                if opcode.name == "STOP" or i >= SNIFF_OPCODES:
+                    return True
+        except Exception:
+            return False
+    return False
+
+
+def human_size(num_bytes) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if num_bytes < 1024 or unit == "GB":
+            break
+        num_bytes /= 1024
+    return f"{num_bytes:,.0f} {unit}" if unit == "B" else f"{num_bytes:,.2f} {unit}"
+
+
+def sidecar_path(file_path) -> Path:
+    return Path(str(file_path) + SIDECAR_SUFFIX)
+
+
+def dump_to_file(obj, file_path, codec=None):
+    """Pickle `obj` to `file_path` with protocol 5. If `codec` is given, as a compressed container
+    (see CompressedWriter). Otherwise, contiguous buffers of at least OUT_OF_BAND_MIN_BYTES (e.g. large NumPy arrays) go out-of-band, into a sidecar
+    file next to it, so they're written straight from the object's memory instead of copied into the stream."""
+    if codec is not None:
+        return dump_compressed(obj, file_path, codec)
+    buffers = []
+
+    def buffer_callback(buffer: pickle.PickleBuffer) -> bool:
+        try:
+            raw = buffer.raw()
+        except BufferError:  # Not contiguous
+            return True
+        if raw.nbytes < OUT_OF_BAND_MIN_BYTES:
+            return True
+        buffers.append(raw)
         return False
 
+    with open(file_path, "wb") as f:
+        pickle.dump(obj, f, protocol=PROTOCOL, buffer_callback=buffer_callback)
+    sidecar = sidecar_path(file_path)
+    if buffers:
+        write_sidecar(sidecar, buffers, file_digest(file_path))
+    elif sidecar.exists():
+        sidecar.unlink()  # Left over from a previous dump to the same file
+    size = os.path.getsize(file_path) + (os.path.getsize(sidecar) if buffers else 0)
+    print(f"\x1b[2mPickled to {file_path} ({human_size(size)}, {len(buffers)} out-of-band buffer(s))\x1b[0m")
+
+
+def file_digest(file_path) -> bytes:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def write_sidecar(sidecar: Path, buffers: list[memoryview], pickle_digest: bytes):
+    """Layout: SIDECAR_MAGIC, the sha256 of the pickle the buffers belong to, the buffer count, an (offset, length)
+    pair per buffer, then the buffers, each starting at a multiple of SIDECAR_ALIGNMENT so it can be memory-mapped
+    back in place."""
+    header_size = len(SIDECAR_MAGIC) + len(pickle_digest) + 8 + 16 * len(buffers)
+    offsets = []
+    offset = header_size
+    for buffer in buffers:
+        offset = -(-offset // SIDECAR_ALIGNMENT) * SIDECAR_ALIGNMENT
+        offsets.append(offset)
+        offset += buffer.nbytes
+    with open(sidecar, "wb") as f:
+        f.write(SIDECAR_MAGIC)
+        f.write(pickle_digest)
+        f.write(struct.pack("<Q", len(buffers)))
+        for offset, buffer in zip(offsets, buffers):
+            f.write(struct.pack("<QQ", offset, buffer.nbytes))
+        for offset, buffer in zip(offsets, buffers):
+            f.write(bytes(offset - f.tell()))
+            f.write(buffer)
+
+
+def map_sidecar(sidecar: Path, pickle_digest: bytes) -> list[Union[mmap.mmap, bytes]]:
+    """The sidecar's buffers as copy-on-write memory maps, one per buffer: pages are read from disk when first
+    touched, and writes to the loaded objects never reach the file. Each buffer is its own map (they're aligned
+    for it) so that `memoryview(buffer).obj` is exactly the buffer, as zero-copy reconstructors expect.
+    Raises ValueError if the sidecar was written for another pickle than the one whose sha256 is `pickle_digest`,
+    e.g. while a BackgroundSave is swapping the pair."""
+    with open(sidecar, "rb") as f:
+        if f.read(len(SIDECAR_MAGIC)) != SIDECAR_MAGIC:
+            raise ValueError(f"{sidecar} is not an ipickle buffers file")
+        if f.read(len(pickle_digest)) != pickle_digest:
+            raise ValueError(f"{sidecar} belongs to another version of its pickle file")
+        (count,) = struct.unpack("<Q", f.read(8))
+        segments = [struct.unpack("<QQ", f.read(16)) for _ in range(count)]
+        return [
+            mmap.mmap(f.fileno(), length, offset=offset, access=mmap.ACCESS_COPY) if length else b""
+            for offset, length in segments
+        ]
+
+
+def load_from_file(file_path):
+    """Unpickle `file_path`, with the out-of-band buffers in its sidecar file if it has one."""
+    if is_compressed_pickle_file(file_path):
+        with io.BufferedReader(DecompressedReader(open(file_path, "rb")), CHUNK_SIZE) as f:
+            return pickle.load(f)
+    sidecar = sidecar_path(file_path)
+    buffers = map_sidecar(sidecar, file_digest(file_path)) if sidecar.exists() else None
+    with open(file_path, "rb") as f:
+        return pickle.load(f, buffers=buffers)
+
+
+CODECS = {
+    "gzip": (partial(gzip.compress, compresslevel=6), gzip.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+try:
+    from compression import zstd  # Python 3.14+
+
+    CODECS["zstd"] = (zstd.compress, zstd.decompress)
+except ImportError:
+    try:
+        import zstandard
+
+        CODECS["zstd"] = (zstandard.compress, zstandard.decompress)
+    except ImportError:
+        pass
+COMPRESSED_MAGIC = b"ipickle-chunks\x00\x00"
+CHUNK_SIZE = 8 * 1024 * 1024
+CHUNK_HEADER = struct.Struct("<QQ")  # Compressed length, raw length; (0, 0) ends the stream
+
+
+def is_compressed_pickle_file(file_path) -> bool:
+    with open(file_path, "rb") as f:
+        return f.read(len(COMPRESSED_MAGIC)) == COMPRESSED_MAGIC
+
+
+class CompressedWriter:
+    """Write-only file for pickle.dump that cuts the stream into CHUNK_SIZE chunks and compresses them on a thread
+    pool, writing them in order. gzip, lzma and zstd all release the GIL while compressing, so threads scale
+    with cores; at most two chunks per worker are in flight.
+
+    Layout: COMPRESSED_MAGIC, the codec's name (one length byte, then the name), then CHUNK_HEADER and data
+    per chunk, ending with an empty chunk."""
+
+    def __init__(self, f, codec: str, workers: int = None):
+        self.f = f
+        self.compress = CODECS[codec][0]
+        workers = workers or os.cpu_count()
+        self.pool = ThreadPoolExecutor(workers)
+        self.max_in_flight = 2 * workers
+        self.in_flight = deque()
+        self.pending = bytearray()
+        self.chunks = 0
+        name = codec.encode()
+        f.write(COMPRESSED_MAGIC + bytes([len(name)]) + name)
+
+    def write(self, data) -> int:
+        """The pickler hands large buffers over in one write, so whole chunks are compressed straight from `data`
+        (the pickler doesn't reuse it); only the ends that don't fill a chunk are copied into `pending`."""
+        data = memoryview(data).cast("B")
+        nbytes = data.nbytes
+        if self.pending:
+            taken = min(CHUNK_SIZE - len(self.pending), nbytes)
+            self.pending += data[:taken]
+            data = data[taken:]
+            if len(self.pending) == CHUNK_SIZE:
+                self._submit(self.pending)
+                self.pending = bytearray()
+        while len(data) >= CHUNK_SIZE:
+            self._submit(data[:CHUNK_SIZE])
+            data = data[CHUNK_SIZE:]
+        self.pending += data
+        return nbytes
+
+    def _submit(self, chunk: Union[bytearray, memoryview]):
+        self.in_flight.append((len(chunk), self.pool.submit(self.compress, chunk)))
+        while len(self.in_flight) > self.max_in_flight:
+            self._write_oldest()
+
+    def _write_oldest(self):
+        raw_length, future = self.in_flight.popleft()
+        compressed = future.result()
+        self.f.write(CHUNK_HEADER.pack(len(compressed), raw_length))
+        self.f.write(compressed)
+        self.chunks += 1
+
+    def close(self):
+        if self.pending:
+            self._submit(self.pending)
+            self.pending = bytearray()
+        while self.in_flight:
+            self._write_oldest()
+        self.f.write(CHUNK_HEADER.pack(0, 0))
+        self.pool.shutdown()
+        self.f.close()
+
+
+class DecompressedReader(io.RawIOBase):
+    """Reads a CompressedWriter container back, decompressing up to two chunks per worker ahead on a thread pool.
+    Wrap it in an io.BufferedReader for pickle.load."""
+
+    def __init__(self, f, workers: int = None):
+        self.f = f
+        if f.read(len(COMPRESSED_MAGIC)) != COMPRESSED_MAGIC:
+            raise ValueError(f"{f.name} is not an ipickle compressed file")
+        codec = f.read(f.read(1)[0]).decode()
+        if codec not in CODECS:
+            raise ValueError(f"{f.name} is compressed with {codec}, which is not available")
+        self.decompress = CODECS[codec][1]
+        workers = workers or os.cpu_count()
+        self.pool = ThreadPoolExecutor(workers)
+        self.max_in_flight = 2 * workers
+        self.in_flight = deque()
+        self.exhausted = False
+        self.current = memoryview(b"")
+        self._read_ahead()
+
+    def _read_ahead(self):
+        while not self.exhausted and len(self.in_flight) < self.max_in_flight:
+            compressed_length, raw_length = CHUNK_HEADER.unpack(self.f.read(CHUNK_HEADER.size))
+            if not raw_length:
+                self.exhausted = True
+                break
+            self.in_flight.append(self.pool.submit(self.decompress, self.f.read(compressed_length)))
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not len(self.current):
+            if not self.in_flight:
+                return 0
+            self.current = memoryview(self.in_flight.popleft().result())
+            self._read_ahead()
+        size = min(len(buffer), len(self.current))
+        buffer[:size] = self.current[:size]
+        self.current = self.current[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.pool.shutdown(cancel_futures=True)
+            self.f.close()
+        super().close()
+
+
+def dump_compressed(obj, file_path, codec: str):
+    writer = CompressedWriter(open(file_path, "wb"), codec)
+    try:
+        pickle.dump(obj, writer, protocol=PROTOCOL)
+    finally:
+        writer.close()
+    if sidecar_path(file_path).exists():
+        sidecar_path(file_path).unlink()  # Left over from a previous dump to the same file
+    size = os.path.getsize(file_path)
+    print(f"\x1b[2mPickled to {file_path} ({human_size(size)}, {codec}, {writer.chunks} chunk(s))\x1b[0m")
+
+
+_background_saves = []
+
+
+class BackgroundSave:
+    """Pickles `obj` to `file_path` the way Redis's BGSAVE does: forks, and the child pickles its copy-on-write
+    snapshot while the session goes on, so later changes to `obj` don't leak into the file. The child writes next to
+    `file_path` and os.replace()s into place, so neither file is ever half-written. The pickle and its sidecar are
+    two renames, though, not one: a load in between finds the new sidecar next to the old pickle, and fails on
+    the sidecar's digest of its pickle (see map_sidecar) rather than loading mismatched buffers.
+    The outcome comes back over a pipe and is printed after the next cell runs; `wait()` blocks for it.
+
+    Without os.fork (Windows), saves in the foreground."""
+
+    def __init__(self, obj, file_path, codec=None):
+        self.file_path = file_path
+        self.error = None
+        self.size = None
+        self.reported = False
+        self.started = perf_counter()
+        self.elapsed = None
+        if not hasattr(os, "fork"):
+            print("[WARNING][ipickle.py] os.fork is not available on this platform; saving in the foreground.")
+            dump_to_file(obj, file_path, codec)
+            self._finish(f"ok {os.path.getsize(file_path)}")
+            return
+        read_fd, write_fd = os.pipe()
+        self.pid = os.fork()
+        if self.pid == 0:
+            # Never return into the child's copy of the session, whatever happens.
+            status = 1
+            try:
+                os.setpgid(0, 0)  # Out of the terminal's process group, so Ctrl-C in the session doesn't reach it
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+                os.close(read_fd)
+                os.write(write_fd, self._save_in_child(obj, codec).encode())
+                status = 0
+            finally:
+                os._exit(status)
+        os.close(write_fd)
+        self._waiter = threading.Thread(target=self._wait_for_child, args=(read_fd,), daemon=True)
+        self._waiter.start()
+        _background_saves.append(self)
+        print(f"\x1b[2mSaving to {file_path} in the background (pid {self.pid})\x1b[0m")
+
+    def _save_in_child(self, obj, codec) -> str:
+        sys.stdout = open(os.devnull, "w")
+        temp_path = f"{self.file_path}.{os.getpid()}.tmp"
+        try:
+            dump_to_file(obj, temp_path, codec)
+            size = os.path.getsize(temp_path)
+            if sidecar_path(temp_path).exists():
+                size += os.path.getsize(sidecar_path(temp_path))
+                os.replace(sidecar_path(temp_path), sidecar_path(self.file_path))
+            elif sidecar_path(self.file_path).exists():
+                sidecar_path(self.file_path).unlink()
+            os.replace(temp_path, self.file_path)
+            return f"ok {size}"
+        except BaseException as e:
+            for path in (temp_path, sidecar_path(temp_path)):
+                if os.path.exists(path):
+                    os.remove(path)
+            return f"error {e.__class__.__name__}: {e}"
+
+    def _wait_for_child(self, read_fd):
+        chunks = []
+        while chunk := os.read(read_fd, 4096):
+            chunks.append(chunk)
+        os.close(read_fd)
+        _, status = os.waitpid(self.pid, 0)
+        self._finish(b"".join(chunks).decode() or f"error child exited with status {status}")
+
+    def _finish(self, message: str):
+        self.elapsed = perf_counter() - self.started
+        outcome, _, detail = message.partition(" ")
+        if outcome == "ok":
+            self.size = int(detail)
+        else:
+            self.error = detail
+
+    @property
+    def done(self) -> bool:
+        return self.elapsed is not None
+
+    def wait(self, timeout: float = None) -> "BackgroundSave":
+        if not self.done:
+            self._waiter.join(timeout)
+        return self
+
+    def __repr__(self) -> str:
+        if not self.done:
+            return f"Saving to {self.file_path} (pid {self.pid}, {perf_counter() - self.started:.1f}s so far)"
+        if self.error:
+            return f"Background save to {self.file_path} failed after {self.elapsed:.3f}s: {self.error}"
+        return f"Saved to {self.file_path} ({human_size(self.size)}) in the background in {self.elapsed:.3f}s"
+
+
+CACHE_BUDGET_BYTES = 2 * 1024**3
+
+
+def cache_dir() -> Path:
+    return Path(get_ipython_dir()) / "ipickle_cache"
 
-def pickle_and_output_variable(var_name, output=None, *, ipython):
+
+def cell_names(cell: str) -> tuple[set, set]:
+    """(names the cell reads before assigning them, names it assigns at its top level), by walking its AST.
+    `cell` must be plain Python: run IPython syntax through `ipython.transform_cell` first.
+
+    Reading means loading a name at an earlier source position than its first store, where an assignment stores
+    only after its value (`x = x + 1` reads x). That errs towards more inputs, e.g. comprehension variables."""
+    tree = ast.parse(cell)
+    first_load = {}
+    first_store = {}
+    assignment_targets = set()
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+            end = (node.end_lineno, node.end_col_offset)
+            for target in node.targets if isinstance(node, ast.Assign) else [node.target]:
+                for name in ast.walk(target):
+                    if isinstance(name, ast.Name) and isinstance(name.ctx, ast.Store):  # Not `cfg` in `cfg[k] = v`
+                        assignment_targets.add(name)
+                        first_store[name.id] = min(first_store.get(name.id, end), end)
+                        if isinstance(node, ast.AugAssign):
+                            first_load[name.id] = min(first_load.get(name.id, end), (node.lineno, node.col_offset))
+        elif isinstance(node, ast.Name) and node not in assignment_targets:
+            position = (node.lineno, node.col_offset)
+            positions = first_load if isinstance(node.ctx, ast.Load) else first_store
+            positions[node.id] = min(positions.get(node.id, position), position)
+    read = {name for name, position in first_load.items() if position < first_store.get(name, (inf, inf))}
+    assigned = set()
+    for statement in tree.body:
+        if isinstance(statement, (ast.Import, ast.ImportFrom)):
+            assigned.update((alias.asname or alias.name).split(".")[0] for alias in statement.names)
+        elif isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            assigned.add(statement.name)
+        else:
+            for node in ast.walk(statement):
+                if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+                    assigned.add(node.id)
+    return read, assigned
+
+
+def is_session_definition(value) -> bool:
+    """A function or class defined in the session, which pickles by name only."""
+    return isinstance(value, (type, types.FunctionType)) and value.__module__ == "__main__"
+
+
+def definition_source(value, namespace: dict, seen: set = None) -> str:
+    """Source of a function or class defined in the session, followed by that of the session's functions and classes
+    its code refers to by global name, recursively, so that changing a helper changes the key of what calls it.
+
+    inspect.getsource can't find classes defined in cells, so a class is its methods' sources plus the repr of its
+    other attributes. Raises OSError if a function's source isn't available."""
+    seen = set() if seen is None else seen
+    seen.add(id(value))
+    if isinstance(value, types.FunctionType):
+        functions = [value]
+        parts = [inspect.getsource(value)]
+    else:
+        functions = []
+        parts = [f"class {value.__qualname__}({', '.join(base.__qualname__ for base in value.__bases__)})"]
+        for name, attribute in vars(value).items():
+            function = getattr(attribute, "__func__", attribute)  # staticmethod, classmethod
+            if isinstance(function, types.FunctionType):
+                functions.append(function)
+                parts.append(inspect.getsource(function))
+            elif not (name.startswith("__") and name.endswith("__")):
+                parts.append(f"{name} = {attribute!r}")
+    codes = [function.__code__ for function in functions]
+    while codes:
+        code = codes.pop()
+        codes.extend(const for const in code.co_consts if isinstance(const, types.CodeType))
+        for name in code.co_names:
+            referenced = namespace.get(name)
+            if is_session_definition(referenced) and id(referenced) not in seen:
+                parts.append(definition_source(referenced, namespace, seen))
+    return "\n".join(parts)
+
+
+def input_digests(read: set, *, ipython) -> dict[str, str]:
+    """sha256 of each read variable that's in the namespace: of its pickle, of a module's name, or of the
+    definition_source of a function or class defined in the session.
+    Raises whatever pickling (or inspect.getsource) raised if a variable can't be pickled."""
+    digests = {}
+    for name in sorted(read):
+        if name not in ipython.user_ns:
+            continue  # A builtin, or assigned by the cell before it's read
+        value = ipython.user_ns[name]
+        if isinstance(value, types.ModuleType):
+            data = value.__name__.encode()
+        elif is_session_definition(value):
+            data = definition_source(value, ipython.user_ns).encode()
+        else:
+            data = pickle.dumps(value, protocol=PROTOCOL)
+        digests[name] = hashlib.sha256(data).hexdigest()
+    return digests
+
+
+def cache_key(cell: str, digests: dict[str, str]) -> str:
+    """sha256 of the source and of the input_digests."""
+    digest = hashlib.sha256(cell.encode())
+    for name, value_digest in sorted(digests.items()):
+        digest.update(f"{name}\0{value_digest}".encode())
+    return digest.hexdigest()
+
+
+def cached_run(cell: str, force=False, *, ipython):
+    """Memoizes a cell on disk. The key is the source plus the state of the variables it reads (see input_digests);
+    the value is the variables it assigns or changes in place (modules by name, re-imported on a hit),
+    stored with dump_to_file.
+    Only variables are restored, not printed output; run_cell displays the cell's result, so nothing is returned.
+    Cells whose inputs or outputs can't be pickled just run, and so do cells with IPython syntax (magics, shell
+    escapes, `obj?`): what those read and assign is up to the magic, not in the source.
+    The cache is kept under CACHE_BUDGET_BYTES by evicting the least recently used entries (by mtime)."""
+    try:
+        read, assigned = cell_names(ipython.transform_cell(cell))
+    except SyntaxError as e:
+        print(f"\x1b[2mNot caching: the cell doesn't parse ({e.__class__.__name__}: {e})\x1b[0m")
+        ipython.run_cell(cell)
+        return
+    if "get_ipython" in read:  # What IPython syntax turns into
+        print("\x1b[2mNot caching: the cell uses magics, shell escapes or help\x1b[0m")
+        ipython.run_cell(cell)
+        return
+    try:
+        digests = input_digests(read, ipython=ipython)
+        key = cache_key(cell, digests)
+    except Exception as e:
+        print(f"\x1b[2mNot caching: an input can't be hashed ({e.__class__.__name__}: {e})\x1b[0m")
+        ipython.run_cell(cell)
+        return
+    path = cache_dir() / f"{key}.pkl"
+    if path.exists() and not force:
+        start = perf_counter()
+        variables = load_from_file(path)
+        for name, value in variables.items():
+            if isinstance(value, CachedModule):
+                value = importlib.import_module(value.name)
+            ipython.user_ns[name] = value
+        os.utime(path)
+        print(f"\x1b[2mRestored {', '.join(variables) or 'nothing'} from cache in {perf_counter() - start:.3f}s\x1b[0m")
+        return
+    result = ipython.run_cell(cell)
+    if not result.success:
+        return
+    try:
+        # Inputs the cell changed in place (`cfg["seen"] = True`, `items.append(x)`) are outputs too.
+        after = input_digests(digests.keys() - assigned, ipython=ipython)
+    except Exception as e:
+        print(f"\x1b[2mNot caching: an input can't be hashed anymore ({e.__class__.__name__}: {e})\x1b[0m")
+        return
+    mutated = {name for name, digest in after.items() if digest != digests[name]}
+    variables = {}
+    for name in sorted(assigned | mutated):
+        if name not in ipython.user_ns:
+            continue  # Deleted by the cell, or only assigned in a branch that didn't run
+        value = ipython.user_ns[name]
+        if isinstance(value, types.ModuleType):
+            value = CachedModule(value.__name__)
+        variables[name] = value
+    defined_here = [name for name, value in variables.items() if is_session_definition(value)]
+    if defined_here:
+        # They'd pickle by name, and a fresh session wouldn't have them to unpickle.
+        print(f"\x1b[2mNot caching: {', '.join(defined_here)} defined in the cell\x1b[0m")
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        dump_to_file(variables, path)
+    except Exception as e:
+        for leftover in (path, sidecar_path(path)):
+            if leftover.exists():
+                leftover.unlink()
+        print(f"\x1b[2mNot caching: an assigned variable can't be pickled ({e.__class__.__name__}: {e})\x1b[0m")
+        return
+    evict_cache(CACHE_BUDGET_BYTES)
+
+
+@dataclass
+class CachedModule:
+    name: str
+
+
+def evict_cache(budget_bytes: int):
+    entries = []
+    for path in cache_dir().glob("*.pkl"):
+        size = path.stat().st_size + (sidecar_path(path).stat().st_size if sidecar_path(path).exists() else 0)
+        entries.append((path.stat().st_mtime, size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= budget_bytes:
+            break
+        path.unlink()
+        if sidecar_path(path).exists():
+            sidecar_path(path).unlink()
+        total -= size
+        print(f"\x1b[2mEvicted {path.name} ({human_size(size)}) from the cache\x1b[0m")
+
+
+def report_finished_saves(*_):
+    """post_run_cell hook: prints background saves that finished since the last cell."""
+    for save in [save for save in _background_saves if save.done]:
+        print(f"\x1b[2m{save}\x1b[0m")
+        _background_saves.remove(save)
+
+
+def sessions_dir() -> Path:
+    return Path(get_ipython_dir()) / "ipickle_sessions"
+
+
+def manifest_path(session: str) -> Path:
+    return sessions_dir() / f"{session}.json"
+
+
+def object_path(digest: str) -> Path:
+    return sessions_dir() / "objects" / digest[:2] / digest
+
+
+def session_variables(*, ipython) -> dict:
+    """The user's variables: no IPython internals (In, Out, _, ...), private names or modules."""
+    hidden = ipython.user_ns_hidden
+    return {
+        name: value
+        for name, value in ipython.user_ns.items()
+        if not name.startswith("_") and name not in hidden and not isinstance(value, types.ModuleType)
+    }
+
+
+def save_session(session="default", *, ipython):
+    """Snapshot the namespace into a content-addressed store: each variable is pickled and kept under the sha256
+    of its bytes, so an unchanged variable costs a pickle and a hash on later saves, but no write.
+    The session's manifest maps variable names to digests; variables that can't be pickled are skipped, and so are
+    functions and classes defined in the session, which pickle by name and couldn't be restored in a fresh one.
+    Objects no manifest refers to anymore are deleted afterwards (see prune_objects)."""
+    start = perf_counter()
+    manifest = {}
+    skipped = []
+    written_bytes = 0
+    written = 0
+    for name, value in session_variables(ipython=ipython).items():
+        if is_session_definition(value):
+            skipped.append(f"{name} (defined in the session)")
+            continue
+        try:
+            data = pickle.dumps(value, protocol=PROTOCOL)
+        except Exception as e:
+            skipped.append(f"{name} ({e.__class__.__name__})")
+            continue
+        digest = hashlib.sha256(data).hexdigest()
+        path = object_path(digest)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = path.with_name(f"{path.name}.tmp")
+            temp_path.write_bytes(data)
+            os.replace(temp_path, path)
+            written += 1
+            written_bytes += len(data)
+        manifest[name] = {"digest": digest, "size": len(data), "type": type(value).__name__}
+    # Written whole and renamed into place, like the objects: prune_objects reads every manifest on every save.
+    sessions_dir().mkdir(parents=True, exist_ok=True)
+    temp_path = manifest_path(session).with_name(f"{manifest_path(session).name}.tmp")
+    temp_path.write_text(json.dumps(manifest, indent=4))
+    os.replace(temp_path, manifest_path(session))
+    pruned, pruned_bytes = prune_objects()
+    print(
+        f"\x1b[2mSaved {len(manifest)} variable(s) to session {session!r} in {perf_counter() - start:.3f}s: "
+        f"{written} changed ({human_size(written_bytes)}), {len(manifest) - written} unchanged, "
+        f"{pruned} unreferenced object(s) deleted ({human_size(pruned_bytes)})\x1b[0m"
+    )
+    if skipped:
+        print(f"\x1b[2mSkipped: {', '.join(skipped)}\x1b[0m")
+
+
+def prune_objects() -> tuple[int, int]:
+    """Delete the objects that no session's manifest refers to (e.g. the previous versions of changed variables).
+    Returns how many were deleted and their total size."""
+    referenced = {
+        entry["digest"] for path in sessions_dir().glob("*.json") for entry in json.loads(path.read_text()).values()
+    }
+    pruned = 0
+    pruned_bytes = 0
+    for path in sessions_dir().glob("objects/*/*"):
+        if path.name in referenced or path.suffix == ".tmp":
+            continue
+        pruned_bytes += path.stat().st_size
+        path.unlink()
+        pruned += 1
+    return pruned, pruned_bytes
+
+
+def load_manifest(session: str) -> dict:
+    path = manifest_path(session)
+    if not path.exists():
+        raise FileNotFoundError(f"no saved session {session!r} (looked for {path})")
+    return json.loads(path.read_text())
+
+
+def restore_session(session="default", names=None, *, ipython):
+    """Restore the variables called `names` (all of them by default) from a saved session.
+    Each variable is its own object file, so restoring one never loads the others, and one that fails to load
+    (say, an instance of a class the fresh session doesn't define) is reported without stopping the rest."""
+    start = perf_counter()
+    manifest = load_manifest(session)
+    missing = [name for name in names or () if name not in manifest]
+    if missing:
+        raise KeyError(f"not in session {session!r}: {', '.join(missing)}")
+    restored_bytes = 0
+    restored = 0
+    failed = []
+    for name in names or manifest:
+        try:
+            ipython.user_ns[name] = pickle.loads(object_path(manifest[name]["digest"]).read_bytes())
+        except Exception as e:
+            failed.append(f"{name} ({e.__class__.__name__}: {e})")
+            continue
+        restored += 1
+        restored_bytes += manifest[name]["size"]
+    print(
+        f"\x1b[2mRestored {restored} variable(s) ({human_size(restored_bytes)}) from session {session!r} "
+        f"in {perf_counter() - start:.3f}s\x1b[0m"
+    )
+    if failed:
+        print(f"[WARNING][ipickle.py] Could not restore: {', '.join(failed)}")
+
+
+def list_session(session="default") -> dict:
+    manifest = load_manifest(session)
+    width = max(map(len, manifest), default=0)
+    for name, entry in sorted(manifest.items(), key=lambda item: item[1]["size"], reverse=True):
+        print(f"{name.ljust(width)}  {entry['type']}  {human_size(entry['size'])}")
+    return manifest
+
+
+def pickle_and_output_variable(var_name, output=None, *, codec=None, background=False, ipython):
     """Pickle a variable and output it to a file or a variable."""
     obj = ipython.user_ns[var_name]
     if output is None:
-        return pickle.dumps(obj)
-    elif os.path.isfile(output) or Path(output).parent.is_dir():
-        with open(output, "wb") as f:
-            pickle.dump(obj, f)
+        return pickle.dumps(obj, protocol=PROTOCOL)
+    elif is_file_output(output):
+        if background:
+            return BackgroundSave(obj, output, codec)
+        dump_to_file(obj, output, codec)
     else:
-        ipython.user_ns[var_name] = pickle.dumps(obj)
+        ipython.user_ns[var_name] = pickle.dumps(obj, protocol=PROTOCOL)
 
 
-def pickle_and_output(expression, output=None, *, ipython):
+def pickle_and_output(expression, output=None, *, codec=None, background=False, ipython):
     """Evaluate an expression, pickle the result and output it to a file or a variable."""
     obj = eval(expression, globals(), ipython.user_ns)
     if output is None:
-        return pickle.dumps(obj)
-    elif os.path.isfile(output) or Path(output).parent.is_dir():
-        with open(output, "wb") as f:
-            pickle.dump(obj, f)
+        return pickle.dumps(obj, protocol=PROTOCOL)
+    elif is_file_output(output):
+        if background:
+            return BackgroundSave(obj, output, codec)
+        dump_to_file(obj, output, codec)
     else:
-        ipython.user_ns[output] = pickle.dumps(obj)
+        ipython.user_ns[output] = pickle.dumps(obj, protocol=PROTOCOL)
 
 
 def unpickle_and_output(file_name, output=None, *, ipython):
     """Unpickle a file and output the result to a variable."""
-    with open(file_name, "rb") as f:
-        obj = pickle.load(f)
+    start = perf_counter()
+    obj = load_from_file(file_name)
+    size = os.path.getsize(file_name)
+    if sidecar_path(file_name).exists():
+        size += os.path.getsize(sidecar_path(file_name))
+    print(f"\x1b[2mUnpickled {file_name} ({human_size(size)}) in {perf_counter() - start:.3f}s\x1b[0m")
     if output is None:
         return obj
     else:
         ipython.user_ns[output] = obj
+
+
+SIZES_DEPTH = 4
+SIZES_FANOUT = 100
+SIZES_TOP = 20
+
+
+class CountingSink:
+    """Write-only file that only counts what's written to it."""
+
+    def __init__(self):
+        self.count = 0
+
+    def write(self, data) -> int:
+        nbytes = memoryview(data).nbytes
+        self.count += nbytes
+        return nbytes
+
+
+@dataclass
+class PickleFrame:
+    path: tuple
+    recorded: bool = True
+    attributes: bool = False  # A reduce state: its keys are attribute names
+    opaque: bool = False  # Reduce arguments, dict keys, set items: their parts aren't labelled
+    reduce_args: object = None
+    reduce_state: object = None
+    is_tuple: bool = False
+    children_bytes: int = 0
+    tuple_index: int = 0
+    pending: deque = None  # (label, value) of the container's items, in the order they're pickled
+
+
+class SizeProfiler(pickle._Pickler):
+    """Pickles objects into a CountingSink and attributes the bytes of the stream to attribute paths
+    (inclusive, down to SIZES_DEPTH levels) and to types (exclusive, so they add up to the total).
+
+    Subclasses the pure-Python pickler: the C one buffers its output, so positions between objects aren't
+    observable. Hooks `save` to measure each object against the stream, `save_reduce` to tell an object's state
+    (named `.attr`) from its reconstruction arguments, and the batching of list and dict items to name them
+    `[i]` and `[key]`. Only the first SIZES_FANOUT items of a container are named; the rest share `[...]`."""
+
+    def __init__(self, name: str = "obj"):
+        self.sink = CountingSink()
+        super().__init__(self.sink, protocol=PROTOCOL)
+        self.name = name
+        self.by_path = {}
+        self.by_type = {}
+        self.total = 0
+        self.failed_path = None
+        self._stack = []
+
+    def measure(self, obj) -> "SizeProfiler":
+        """Pickle `obj`. On failure, `failed_path` is where."""
+        self.dump(obj)
+        self.total = self.sink.count
+        return self
+
+    def tell(self) -> int:
+        current_frame = self.framer.current_frame
+        return self.sink.count + (current_frame.tell() if current_frame is not None else 0)
+
+    def save(self, obj, save_persistent_id=True):
+        frame = self._child_frame(obj)
+        frame.is_tuple = type(obj) is tuple
+        self._stack.append(frame)
+        start = self.tell()
+        try:
+            super().save(obj, save_persistent_id)
+        except Exception:
+            if self.failed_path is None:
+                self.failed_path = "".join(frame.path)
+            raise
+        finally:
+            self._stack.pop()
+        size = self.tell() - start
+        if self._stack:
+            self._stack[-1].children_bytes += size
+        module = type(obj).__module__
+        type_name = type(obj).__qualname__ if module == "builtins" else f"{module}.{type(obj).__qualname__}"
+        self.by_type[type_name] = self.by_type.get(type_name, 0) + size - frame.children_bytes
+        if frame.recorded:
+            path = "".join(frame.path)
+            self.by_path[path] = self.by_path.get(path, 0) + size
+
+    def _child_frame(self, obj) -> PickleFrame:
+        if not self._stack:
+            return PickleFrame((self.name,))
+        parent = self._stack[-1]
+        transparent = partial(PickleFrame, parent.path, recorded=False)
+        if parent.pending:
+            label, value = parent.pending[0]
+            if obj is not value:
+                return transparent(opaque=True)  # The key of a dict item
+            parent.pending.popleft()
+            return self._labelled_frame(parent, label)
+        if parent.opaque:
+            return transparent(opaque=True)
+        if parent.reduce_state is not None and obj is parent.reduce_state:
+            return transparent(attributes=True)
+        if parent.reduce_args is not None and obj is parent.reduce_args:
+            return transparent(opaque=True)
+        if parent.attributes and parent.is_tuple:
+            return transparent(attributes=True)  # (state, slots) pairs
+        if parent.is_tuple:
+            index = parent.tuple_index
+            parent.tuple_index += 1
+            return self._labelled_frame(parent, f"[{index}]" if index < SIZES_FANOUT else "[...]")
+        return transparent(opaque=True)  # Set items, the reconstructing callable
+
+    def _labelled_frame(self, parent: PickleFrame, label: str) -> PickleFrame:
+        path = parent.path + (label,)
+        return PickleFrame(path, recorded=len(path) <= SIZES_DEPTH + 1)
+
+    def save_reduce(self, func, args, state=None, *rest, **kwargs):
+        frame = self._stack[-1]
+        frame.reduce_args, frame.reduce_state = args, state
+        return super().save_reduce(func, args, state, *rest, **kwargs)
+
+    def _batch_appends(self, items, *rest):
+        return super()._batch_appends(self._queued(items, dict_items=False), *rest)
+
+    def _batch_setitems(self, items, *rest):
+        return super()._batch_setitems(self._queued(items, dict_items=True), *rest)
+
+    def _queued(self, items, dict_items: bool):
+        """Pass `items` through, queueing a label for each value on the current frame as the pickler reads it
+        (it reads ahead in batches, then pickles them in order)."""
+        frame = self._stack[-1]
+        if frame.pending is None:
+            frame.pending = deque()
+        for index, item in enumerate(items):
+            key, value = item if dict_items else (index, item)
+            if index >= SIZES_FANOUT:
+                label = "[...]"
+            elif dict_items and frame.attributes and isinstance(key, str):
+                label = f".{key}"
+            elif dict_items:
+                label = f"[{reprlib.repr(key)}]"
+            else:
+                label = f"[{index}]"
+            frame.pending.append((label, value))
+            yield item
+
+    def __repr__(self) -> str:
+        lines = [f"{self.name}: {human_size(self.total)} pickled"]
+        for title, sizes in (("By path (inclusive)", self.by_path), ("By type (exclusive)", self.by_type)):
+            top = sorted(sizes.items(), key=lambda item: item[1], reverse=True)[:SIZES_TOP]
+            width = max((len(key) for key, _ in top), default=0)
+            lines += ["", title]
+            lines += [
+                f"  {key.ljust(width)}  {human_size(size):>10}  {size / (self.total or 1):>6.1%}" for key, size in top
+            ]
+        return "\n".join(lines)
+
+
+def process_sizes(arguments, *, ipython) -> SizeProfiler:
+    """%ipickle --sizes <expression>: where the bytes of its pickle go, without writing it anywhere."""
+    if len(arguments) != 1:
+        raise ValueError(f"expecting one expression after --sizes, got {arguments!r}")
+    expression = arguments[0]
+    obj = eval(expression, globals(), ipython.user_ns)
+    profiler = SizeProfiler(expression)
+    try:
+        return profiler.measure(obj)
+    except Exception as e:
+        raise pickle.PicklingError(f"at {profiler.failed_path}: {e.__class__.__name__}: {e}") from e
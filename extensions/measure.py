@@ -1,34 +1,132 @@
 """
 %load_ext measure
 measurements=%measure import rich
+import_profile=%measure --cold import rich
+interpreters=%measure sorted(data) -s data = list(range(1000)) --pythons /usr/bin/python3.11,/opt/py313/bin/python
+latencies=%measure --async await asyncio.sleep(0.001) -s import asyncio --budget 2
 measurements=%measure sleep(5) -s from time import sleep -n 5,10
+measurements=%measure sorted(data) -s data = list(range(1000)) --auto --budget 5 --rel-err 0.005
+measurements=%measure sorted(data) -s data = list(range(1000)) -n 1000,10000 --isolate --workers 2 --pin
+regressions=%measure sorted(data) -s data = list(range(1000)) --compare
+measurements=%measure sorted(data) -s data = list(range(1000)) -n 10,100,1000 --interleave --rounds 50 --warmup 3
+measurements=%measure [0] * 10_000 -n 1,10,100 --memory
+measurements=%measure json.dumps(data) -s import json; data = {"a": [1, 2, 3] * 1000} -n 100 --profile
+measurements["100"].hotspots
+measurements.flamegraph("json_dumps")  # json_dumps.folded, json_dumps.speedscope.json
+measurements=%measure sorted(data) -s data = list(range(100_000)) -n 10,100,1000,10000 --variance --background
+measurements.cancel()  # Keeps the measurements done so far; measurements.wait() blocks until all are
+sweep=%measure sorted(data) -s data = list(range(n, 0, -1)) -p n=10,100,1000,10000
+sweep.plot()
+scaling=%measure sum(range(10_000)) --scale 1,2,4,8
+scaling.plot()
 measurements.plot()
 measurements[:5].plot()
+
+%%measure -s import random --budget 5
+## setup
+data = [random.random() for _ in range(1000)]
+## sorted
+sorted(data)
+## sort
+data.copy().sort()
 """
+import asyncio
+import cProfile
+import gc
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import pstats
+import random
 import re
-from collections import namedtuple
-from copy import deepcopy
-from dataclasses import dataclass, field
-from time import perf_counter_ns
-from timeit import timeit
-from typing import ForwardRef, Iterable, Union
+import sqlite3
+import subprocess
+import sys
+import textwrap
+import threading
+import tracemalloc
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from itertools import chain, repeat
+from math import ceil, erfc, inf, log
+from operator import mul, sub
+from pathlib import Path
+from time import get_clock_info, perf_counter_ns, process_time_ns, thread_time_ns, time
+from timeit import Timer, timeit
+from typing import ForwardRef, Iterable, Optional, Union
 
+from IPython import get_ipython
 from IPython.core.magic import register_line_cell_magic
+from IPython.paths import get_ipython_dir
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
 
 
 HDIV = "\033[90m|\033[0m"
 
+DEFAULT_RUNS_COUNTS = (*range(1, 11), 100, 1000, 10_000, 100_000)
+DEFAULT_BUDGET = 10.0  # seconds
+DEFAULT_REL_ERR = 0.01
+AUTORANGE_TARGET_SAMPLES = 100
+AUTORANGE_MIN_SAMPLES = 5
+OVERHEAD_REPEATS = 3
+ASYNC_MAX_RUNS = 1_000_000
+LOOP_LAG_INTERVAL_NS = 1_000_000
+SCALE_BATCH_NS = 100_000
+SCALE_MIN_DURATION_NS = 200_000_000
+SCALE_EFFICIENT = 0.7
+PROFILE_SAMPLING_THRESHOLD_NS = 1_000_000_000
+SAMPLING_INTERVAL_NS = 1_000_000
+PROFILE_TOP = 15
+FLAMEGRAPH_MIN_NS = 1_000_000_000
+BACKGROUND_POLL_SEC = 0.5
+INTERLEAVE_ROUNDS = 30
+WARMUP_ROUNDS = 1
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+TIMER_RESOLUTION_NS = get_clock_info("perf_counter").resolution * 1_000_000_000
+COMPARISON_MIN_ROUNDS = 20
+SIGNIFICANCE_LEVEL = 0.05
+CPU_PERCENT_MIN_PROBE_RATIO = 100
+BASELINE_MIN_CHANGE = 0.05  # Smaller changes of the median are reported as "no change" however significant
+BASELINE_BLOCKS = 10  # Consecutive stretches of a burst of samples whose medians are compared, not the samples
+
 
 def get_justification(*items):
     return max(map(lambda x: len(str(x)), [*items]))
 
 
+def format_table(rows: list[tuple[str, ...]], left_columns: Iterable[int] = (0,)) -> str:
+    """Rows of cells separated by HDIV, each column as wide as its widest cell: left-justified if its index is in
+    `left_columns`, right-justified otherwise. The first row is usually the header."""
+    left_columns = set(left_columns)
+    widths = [get_justification(*column) for column in zip(*rows)]
+    return "\n".join(
+        f" {HDIV} ".join(
+            cell.ljust(width) if column in left_columns else cell.rjust(width)
+            for column, (cell, width) in enumerate(zip(row, widths))
+        )
+        for row in rows
+    )
+
+
 def fmt_num(num, dec=2) -> str:
-    if dec == 0:
-        return f"{num:,}"
     return f"{num:,.{dec}f}"
 
 
+def fmt_percent(percent: Optional[float]) -> str:
+    return "-" if percent is None else f"{fmt_num(percent)}%"
+
+
 def human_ns(ns, dec=2) -> str:
     sec = ns / 1_000_000_000
     if sec >= 1:
@@ -42,28 +140,112 @@ def human_ns(ns, dec=2) -> str:
     return f"{fmt_num(ns, dec)} ns"
 
 
+def human_bytes(num_bytes, dec=2) -> str:
+    sign = "-" if num_bytes < 0 else ""
+    num_bytes = abs(num_bytes)
+    for unit in ("B", "KB", "MB", "GB"):
+        if num_bytes < 1024 or unit == "GB":
+            break
+        num_bytes /= 1024
+    return f"{sign}{fmt_num(num_bytes, 0 if unit == 'B' else dec)} {unit}"
+
+
+def relative_margin_of_error(count: int, total: int, sum_of_squares: int, z=1.96) -> float:
+    """Half-width of the mean's ~95% confidence interval, as a fraction of the mean."""
+    if count < 2 or not total:
+        return inf
+    variance = max(count * sum_of_squares - total**2, 0) / (count * (count - 1))
+    return z * (variance / count) ** 0.5 / (total / count)
+
+
+def calibrate(timer: Timer, target_ns: int, deadline: int) -> tuple[int, int]:
+    """Finds the smallest run count in 1, 2, 5, 10, 20, 50, ... whose timing takes at least `target_ns`
+    (or whatever was reached by `deadline`, a perf_counter_ns() value). Returns (run_count, nanosec)."""
+    multiplier = 1
+    while True:
+        for step in (1, 2, 5):
+            run_count = multiplier * step
+            nanosec = timer.timeit(run_count)
+            if nanosec >= target_ns or perf_counter_ns() >= deadline:
+                return run_count, nanosec
+        multiplier *= 10
+
+
+def mann_whitney_u(a: Iterable[float], b: Iterable[float]) -> float:
+    """Two-sided p-value of the Mann-Whitney U test that `a` and `b` come from the same distribution.
+    Normal approximation with tie and continuity corrections; fine for the dozens+ of samples we collect."""
+    combined = sorted(chain(((value, 0) for value in a), ((value, 1) for value in b)))
+    n = len(combined)
+    n1 = sum(1 for _, group in combined if group == 0)
+    n2 = n - n1
+    if not n1 or not n2:
+        return 1.0
+    rank_sum_a = 0.0
+    ties = 0
+    i = 0
+    while i < n:
+        j = i
+        while j + 1 < n and combined[j + 1][0] == combined[i][0]:
+            j += 1
+        average_rank = (i + j) / 2 + 1
+        rank_sum_a += average_rank * sum(1 for k in range(i, j + 1) if combined[k][1] == 0)
+        tied = j - i + 1
+        ties += tied**3 - tied
+        i = j + 1
+    u = rank_sum_a - n1 * (n1 + 1) / 2
+    sigma = ((n1 * n2 / 12) * ((n + 1) - ties / (n * (n - 1)))) ** 0.5
+    if not sigma:
+        return 1.0
+    z = max(abs(u - n1 * n2 / 2) - 0.5, 0) / sigma
+    return erfc(z / 2**0.5)
+
+
 Most = namedtuple("Most", ["ns", "index"])
 
+PERCENTILES = (5, 25, 75, 95, 99)
 
-@dataclass
-class Run:
-    nanosec: int
-    deviation: int
+
+def percentile(sorted_values, q: float) -> float:
+    """Linear interpolation between closest ranks (numpy's default method). `sorted_values` must be sorted."""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q / 100
+    lo = int(position)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (position - lo)
 
 
 @dataclass
 class Stats:
-    runs: list[Run] = field(default_factory=list)
+    """Distribution of many repetitions of the same `run_count` runs.
+
+    Each repetition's total is stored as a signed 64-bit int in `samples` (8 bytes per repetition),
+    and every summary value is derived from it with C-level builtins (sorted, sum, map) rather than per-sample objects.
+    All summary values are per-run nanoseconds, i.e. a repetition's total divided by `run_count`.
+    """
+
+    samples: array = field(default_factory=lambda: array("q"))
+    run_count: int = 1
     variance = 0
     stdev = 0
     slowest = None
     fastest = None
     nanosec_sum = None
     nanosec_avg = None
+    median = None
+    percentiles: dict = field(default_factory=dict)
+    mad = 0
+    outliers = 0
+    resources = None  # ResourceUsage of the measurement's main pass, set by Measurement
+    overhead = None  # Overhead of `run_count` empty runs, set by Measurement
 
-    def calculate(
-        self, stmt: str, *, setup: str, timer, run_count: int, nanosec_sum: int, nanosec_avg: float, _globals=None
-    ):
+    @classmethod
+    def from_samples(cls, samples: Iterable[int], run_count: int = 1) -> ForwardRef("Stats"):
+        stats = cls(samples=array("q", samples), run_count=run_count)
+        stats.summarize()
+        return stats
+
+    def calculate(self, stmt: str, *, setup: str, timer, run_count: int, nanosec_sum: int, _globals=None):
         for duration in (
             # 10_000_000_000,
             5_000_000_000,  # 10 s to 1 ms
@@ -76,7 +258,7 @@ class Stats:
             1_000_000,
         ):
             if nanosec_sum < duration:
-                repetitions = duration // nanosec_sum
+                repetitions = duration // max(nanosec_sum, 1)
                 break
         else:
             print(
@@ -86,66 +268,590 @@ class Stats:
 
         print(f"Calculating variance among {repetitions:,} repetitions...")
 
-        self.nanosec_sum = nanosec_sum
-        self.nanosec_avg = nanosec_avg
-        deviation_sum = 0
+        self.run_count = run_count
+        append = self.samples.append
+        for _ in range(repetitions):
+            append(timeit(stmt, setup=setup, timer=timer, number=run_count, globals=_globals))
+        self.summarize()
+
+    def summarize(self):
+        """(Re)compute every summary value from `samples`."""
+        samples = self.samples
+        count = len(samples)
+        if not count:
+            return
+        run_count = self.run_count
+        total = sum(samples)
+        self.nanosec_sum = total
+        self.nanosec_avg = total / count / run_count
 
-        for i in range(repetitions):
-            nanosec = timeit(stmt, setup=setup, timer=timer, number=run_count, globals=_globals)
+        # Exact integer arithmetic: n·Σx² − (Σx)² never loses precision, unlike summing float deviations.
+        if count > 1:
+            sum_of_squares = sum(map(mul, samples, samples))
+            self.variance = int((count * sum_of_squares - total**2) / (count * (count - 1)) / run_count**2)
+            self.stdev = int(self.variance**0.5)
 
-            if (self.fastest and nanosec < self.fastest.ns) or not self.fastest:
-                self.fastest = Most(nanosec, i)
-            if (self.slowest and nanosec > self.slowest.ns) or not self.slowest:
-                self.slowest = Most(nanosec, i)
+        slowest = max(samples)
+        fastest = min(samples)
+        self.slowest = Most(slowest / run_count, samples.index(slowest))
+        self.fastest = Most(fastest / run_count, samples.index(fastest))
 
-            deviation = (nanosec - nanosec_avg) ** 2
-            deviation_sum += deviation
-            self.runs.append(Run(nanosec, deviation))
+        ordered = sorted(samples)
+        median = percentile(ordered, 50)
+        self.median = median / run_count
+        self.percentiles = {q: percentile(ordered, q) / run_count for q in PERCENTILES}
+        self.mad = percentile(sorted(map(abs, map(sub, ordered, repeat(median)))), 50) / run_count
 
-        self.variance = int(deviation_sum / (run_count - 1))
-        self.stdev = int(self.variance**0.5)
+        q1 = percentile(ordered, 25)
+        q3 = percentile(ordered, 75)
+        fence = 1.5 * (q3 - q1)
+        self.outliers = bisect_left(ordered, q1 - fence) + (count - bisect_right(ordered, q3 + fence))
 
     def __repr__(self) -> str:
-        stdev_percent = fmt_num((self.stdev * 100) / self.nanosec_avg)
-        slowest_percent = fmt_num((self.slowest.ns * 100) / self.nanosec_avg)
-        fastest_percent = fmt_num((self.fastest.ns * 100) / self.nanosec_avg)
-        avg_human = human_ns(self.nanosec_avg)
-        sum_human = human_ns(self.nanosec_sum)
-        stdev_human = human_ns(self.stdev)
-        slowest_human = human_ns(self.slowest.ns)
-        fastest_human = human_ns(self.fastest.ns)
-        col_1_rjust = get_justification(avg_human, sum_human, stdev_human, slowest_human, fastest_human)
-        col_2_rjust = get_justification(stdev_percent, slowest_percent, fastest_percent)
-        col_3_rjust = get_justification(self.slowest.index, self.fastest.index)
-        return "\n".join(
-            [
-                f"Avg      {HDIV} {avg_human.rjust(col_1_rjust)} {HDIV}",
-                f"Total    {HDIV} {sum_human.rjust(col_1_rjust)} {HDIV}",
-                f"Std. Dev {HDIV} {stdev_human.rjust(col_1_rjust)} {HDIV} {stdev_percent.rjust(col_2_rjust)}%",
-                f"Slowest  {HDIV} {slowest_human.rjust(col_1_rjust)} {HDIV} {slowest_percent.rjust(col_2_rjust)}% {HDIV} Run # {str(self.slowest.index).rjust(col_3_rjust)}",
-                f"Fastest  {HDIV} {fastest_human.rjust(col_1_rjust)} {HDIV} {fastest_percent.rjust(col_2_rjust)}% {HDIV} Run # {str(self.fastest.index).rjust(col_3_rjust)}",
-            ]
-        )
+        if not self.samples:
+            return "No samples"
+
+        def percent_of_avg(ns) -> str:
+            return fmt_num((ns * 100) / self.nanosec_avg) if self.nanosec_avg else "-"
+
+        rows = [
+            ("Avg", human_ns(self.nanosec_avg), "", ""),
+            ("Median", human_ns(self.median), percent_of_avg(self.median) + "%", ""),
+            ("Total", human_ns(self.nanosec_sum), "", f"{len(self.samples):,} reps"),
+            ("Std. Dev", human_ns(self.stdev), percent_of_avg(self.stdev) + "%", ""),
+            ("MAD", human_ns(self.mad), percent_of_avg(self.mad) + "%", ""),
+            *((f"p{q}", human_ns(ns), percent_of_avg(ns) + "%", "") for q, ns in self.percentiles.items()),
+            (
+                "Slowest",
+                human_ns(self.slowest.ns),
+                percent_of_avg(self.slowest.ns) + "%",
+                f"Run # {self.slowest.index}",
+            ),
+            (
+                "Fastest",
+                human_ns(self.fastest.ns),
+                percent_of_avg(self.fastest.ns) + "%",
+                f"Run # {self.fastest.index}",
+            ),
+            ("Outliers", f"{self.outliers:,}", "", "outside 1.5×IQR"),
+            *(self._overhead_rows() if self.overhead and self.overhead.nanosec else ()),
+            *(self.resources.rows() if self.resources is not None else ()),
+        ]
+        col_0_ljust = get_justification(*(row[0] for row in rows))
+        col_1_rjust = get_justification(*(row[1] for row in rows))
+        col_2_rjust = get_justification(*(row[2] for row in rows))
+        lines = []
+        for label, value, percent, extra in rows:
+            line = f"{label.ljust(col_0_ljust)} {HDIV} {value.rjust(col_1_rjust)} {HDIV}"
+            if percent or extra:
+                line += f" {percent.rjust(col_2_rjust)}"
+            if extra:
+                line += f" {HDIV} {extra}"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def _overhead_rows(self) -> list[tuple[str, str, str, str]]:
+        overhead_avg = self.overhead.nanosec / self.run_count
+        median_total = self.median * self.run_count
+        if self.overhead.is_reliable(median_total):
+            net_median, note = human_ns(self.overhead.net(median_total) / self.run_count), ""
+        else:
+            net_median, note = "-", "unreliable: below loop overhead noise"
+        return [
+            (
+                "Overhead",
+                human_ns(overhead_avg),
+                f"{fmt_num(overhead_avg * 100 / self.nanosec_avg)}%",
+                "empty statement",
+            ),
+            ("Net med.", net_median, "", note),
+        ]
+
+    def to_dict(self) -> dict:
+        return {"samples": self.samples.tobytes(), "run_count": self.run_count}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> ForwardRef("Stats"):
+        samples = array("q")
+        samples.frombytes(data["samples"])
+        stats = cls(samples=samples, run_count=data["run_count"])
+        stats.summarize()
+        return stats
 
     def __bool__(self):
-        return bool(self.variance)
+        return bool(self.samples)
+
+
+@dataclass
+class MemoryUsage:
+    """Allocation profile of one extra pass of `run_count` runs under tracemalloc.
+
+    CPython keeps no cumulative allocation counter, so `net_blocks` is the change in allocated memory blocks
+    (allocations minus frees) over the pass, per sys.getallocatedblocks()."""
+
+    peak_bytes: int
+    retained_bytes: int
+    net_blocks: int
+    gc_collections: int
+
+    @classmethod
+    def trace(cls, stmt: str, setup="pass", run_count: int = 1, _globals=None) -> ForwardRef("MemoryUsage"):
+        """timeit calls its timer right after `setup` and right after the loop, so a probing timer
+        traces exactly the `run_count` runs and none of the setup's allocations.
+        The collector is kept on (timeit would turn it off), so `gc_collections` and the peak are what a real run
+        would see."""
+        readings = []
+
+        def probe():
+            if not readings:
+                readings.append(
+                    (sum(generation["collections"] for generation in gc.get_stats()), sys.getallocatedblocks())
+                )
+                tracemalloc.reset_peak()
+                readings.append(tracemalloc.get_traced_memory()[0])
+            else:
+                readings.append(tracemalloc.get_traced_memory())
+                readings.append(
+                    (sum(generation["collections"] for generation in gc.get_stats()), sys.getallocatedblocks())
+                )
+            return 0
+
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start()
+        try:
+            Timer(stmt, setup=scheduled_setup(setup, disable_gc=False), timer=probe, globals=_globals).timeit(run_count)
+        finally:
+            if not was_tracing:
+                tracemalloc.stop()
+        (gc_before, blocks_before), traced_before, (traced_after, traced_peak), (gc_after, blocks_after) = readings
+        return cls(
+            peak_bytes=traced_peak - traced_before,
+            retained_bytes=traced_after - traced_before,
+            net_blocks=blocks_after - blocks_before,
+            gc_collections=gc_after - gc_before,
+        )
+
+    def __str__(self) -> str:
+        return (
+            f"Peak: {human_bytes(self.peak_bytes)} {HDIV} Retained: {human_bytes(self.retained_bytes)}"
+            f" {HDIV} Blocks: {self.net_blocks:+,} {HDIV} GCs: {self.gc_collections:,}"
+        )
+
+
+def resource_snapshot(opening=True) -> tuple:
+    """(wall ns, process CPU ns, thread CPU ns, how long reading those three took, getrusage).
+
+    The three clocks are read in the same order at both ends of a window, so each CPU window is the wall window
+    shifted by a few ns, not nested inside or around it. getrusage, the slow part, stays outside the window:
+    first when `opening` it, last when closing it."""
+    usage = resource.getrusage(resource.RUSAGE_SELF) if resource and opening else None
+    wall_ns = perf_counter_ns()
+    process_ns = process_time_ns()
+    thread_ns = thread_time_ns()
+    read_ns = perf_counter_ns() - wall_ns
+    if resource and not opening:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+    return wall_ns, process_ns, thread_ns, read_ns, usage
+
+
+@dataclass
+class ResourceUsage:
+    """CPU time and OS counters over a timed region (see ResourceProbe).
+
+    process/thread CPU time well below wall time means waiting (I/O, locks, sleeping); involuntary context switches
+    mean preemption by other processes; major page faults mean paging. `max_rss_bytes` is the process's high-water
+    mark, not a delta. Counters are zero where the `resource` module isn't available (Windows).
+
+    The clocks themselves take `probe_ns` to read, which shifts the CPU windows against the wall window; below
+    CPU_PERCENT_MIN_PROBE_RATIO times that, CPU percentages are noise, and are left out."""
+
+    wall_ns: int
+    process_ns: int
+    thread_ns: int
+    runs: int = 1
+    probe_ns: int = 0
+    voluntary_switches: int = 0
+    involuntary_switches: int = 0
+    minor_faults: int = 0
+    major_faults: int = 0
+    max_rss_bytes: int = 0
+
+    @classmethod
+    def between(cls, before: tuple, after: tuple, runs: int = 1) -> ForwardRef("ResourceUsage"):
+        """Usage between two resource_snapshot()s."""
+        wall_before, process_before, thread_before, read_before, usage_before = before
+        wall_after, process_after, thread_after, read_after, usage_after = after
+        counters = {}
+        if usage_after is not None:
+            counters = dict(
+                voluntary_switches=usage_after.ru_nvcsw - usage_before.ru_nvcsw,
+                involuntary_switches=usage_after.ru_nivcsw - usage_before.ru_nivcsw,
+                minor_faults=usage_after.ru_minflt - usage_before.ru_minflt,
+                major_faults=usage_after.ru_majflt - usage_before.ru_majflt,
+                # Kilobytes on Linux, bytes on macOS.
+                max_rss_bytes=usage_after.ru_maxrss * (1 if sys.platform == "darwin" else 1024),
+            )
+        return cls(
+            wall_ns=wall_after - wall_before,
+            process_ns=process_after - process_before,
+            thread_ns=thread_after - thread_before,
+            runs=runs,
+            probe_ns=read_before + read_after,
+            **counters,
+        )
+
+    @property
+    def measurable(self) -> bool:
+        return self.wall_ns > 0 and self.wall_ns >= CPU_PERCENT_MIN_PROBE_RATIO * self.probe_ns
+
+    @property
+    def cpu_percent(self) -> Optional[float]:
+        """Process CPU time over wall time, or None if the window is too short to tell."""
+        return self.process_ns * 100 / self.wall_ns if self.measurable else None
+
+    @property
+    def thread_percent(self) -> Optional[float]:
+        return self.thread_ns * 100 / self.wall_ns if self.measurable else None
+
+    @property
+    def verdict(self) -> str:
+        if self.major_faults:
+            return "paging"
+        if self.cpu_percent is None:
+            return "too short to tell"
+        if self.cpu_percent >= 90:
+            return "CPU-bound"
+        if self.voluntary_switches:
+            return "blocked (I/O or locks)"
+        return "waiting"
+
+    def rows(self) -> list[tuple[str, str, str, str]]:
+        """(label, value, percent, extra) rows in Stats.__repr__'s format; times are per run."""
+        return [
+            ("CPU", human_ns(self.process_ns / self.runs), fmt_percent(self.cpu_percent), self.verdict),
+            ("Thread", human_ns(self.thread_ns / self.runs), fmt_percent(self.thread_percent), ""),
+            ("Ctx sw.", f"{self.voluntary_switches:,}/{self.involuntary_switches:,}", "", "voluntary/involuntary"),
+            ("Faults", f"{self.minor_faults:,}/{self.major_faults:,}", "", "minor/major"),
+            ("Max RSS", human_bytes(self.max_rss_bytes), "", ""),
+        ]
+
+    def __str__(self) -> str:
+        return (
+            f"CPU: {fmt_percent(self.cpu_percent)} ({self.verdict}) {HDIV} Ctx sw.: "
+            f"{self.voluntary_switches:,}/{self.involuntary_switches:,} {HDIV} Faults: "
+            f"{self.minor_faults:,}/{self.major_faults:,} {HDIV} Max RSS: {human_bytes(self.max_rss_bytes)}"
+        )
+
+
+class ResourceProbe:
+    """A timeit timer that also snapshots CPU times and getrusage() — outside the timed window, so the timing
+    itself isn't inflated. timeit calls its timer exactly twice: after setup and after the loop.
+    CPU usage is over the snapshots' own wall window, which encloses the timed one (see resource_snapshot)."""
+
+    def __init__(self, timer=perf_counter_ns):
+        self.timer = timer
+        self.readings = []
+
+    def __call__(self):
+        if not self.readings:
+            self.readings.append(resource_snapshot())
+            now = self.timer()
+            self.readings.append(now)
+            return now
+        now = self.timer()
+        self.readings.append(now)
+        self.readings.append(resource_snapshot(opening=False))
+        return now
+
+    def usage(self, runs: int = 1) -> ResourceUsage:
+        before, _, _, after = self.readings
+        return ResourceUsage.between(before, after, runs=runs)
+
+
+Frame = tuple  # (filename, first line number, function name)
+
+
+def frame_label(frame: Frame) -> str:
+    filename, line, name = frame
+    if filename == "~":  # cProfile's marker for built-ins
+        return name
+    return f"{name} ({Path(filename).name}:{line})"
+
+
+class StackSampler:
+    """Samples the calling thread's stack every `interval_ns` from a background thread, while used as a context manager.
+
+    Stacks are root-first tuples of Frames, trimmed to start at timeit's inner function, so the session's own frames
+    (IPython, the magic) don't show up. Costs the sampled thread nothing between samples, unlike cProfile's hooks.
+    The sampler needs the GIL to look, so the switch interval is lowered to match while sampling, and
+    `sample_ns` is the wall time each sample actually stands for."""
+
+    def __init__(self, interval_ns: int = SAMPLING_INTERVAL_NS):
+        self.interval_ns = interval_ns
+        self.stacks: Counter = Counter()
+        self.sample_ns = interval_ns
+        self._stop = threading.Event()
+        self._thread = None
+        self._switch_interval = None
+        self._start = None
+
+    def _sample(self, target_thread_id: int):
+        interval = self.interval_ns / 1_000_000_000
+        while not self._stop.wait(interval):
+            frame = sys._current_frames().get(target_thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                if code.co_filename == "<timeit-src>":
+                    self.stacks[tuple(reversed(stack))] += 1
+                    break
+                frame = frame.f_back
+
+    def __enter__(self) -> ForwardRef("StackSampler"):
+        self._switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self._switch_interval, self.interval_ns / 1_000_000_000))
+        self._thread = threading.Thread(target=self._sample, args=(threading.get_ident(),), daemon=True)
+        self._start = perf_counter_ns()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = perf_counter_ns() - self._start
+        self._stop.set()
+        self._thread.join()
+        sys.setswitchinterval(self._switch_interval)
+        if self.stacks:
+            self.sample_ns = elapsed / sum(self.stacks.values())
+
+
+@dataclass
+class Hotspot:
+    function: str
+    self_ns: float
+    cumulative_ns: float
+    calls: Optional[int]  # None when sampled
+
+
+class Hotspots:
+    """Where one extra pass of `run_count` runs spends its time, ranked by self time.
+
+    Statements whose pass takes under PROFILE_SAMPLING_THRESHOLD_NS run under cProfile (exact call counts, but
+    per-call overhead inflates tiny functions); longer ones under a StackSampler (no call counts, negligible overhead).
+    Either way only the timed loop is profiled, not `setup`."""
+
+    def __init__(self, rows: list[Hotspot], method: str, stacks: Counter = None, sample_ns: float = None):
+        self.rows = sorted(rows, key=lambda row: row.self_ns, reverse=True)
+        self.method = method
+        self.stacks = stacks or Counter()  # Only for the sampling method
+        self.sample_ns = sample_ns
+
+    @classmethod
+    def profile(
+        cls, stmt: str, setup="pass", run_count: int = 1, _globals=None, sampling: bool = False
+    ) -> ForwardRef("Hotspots"):
+        if sampling:
+            return cls.sample(stmt, setup, run_count, _globals)
+        profiler = cProfile.Profile()
+        calls = []
+
+        def toggling_timer():
+            # Called by timeit right after setup, then right after the loop.
+            if calls:
+                profiler.disable()
+            calls.append(None)
+            if len(calls) == 1:
+                profiler.enable()
+            return 0
+
+        Timer(stmt, setup=setup, timer=toggling_timer, globals=_globals).timeit(run_count)
+        toggling_frame = (__file__, toggling_timer.__code__.co_firstlineno, toggling_timer.__name__)
+        rows = [
+            Hotspot(frame_label(function), self_sec * 1e9, cumulative_sec * 1e9, calls)
+            for function, (_, calls, self_sec, cumulative_sec, callers) in pstats.Stats(profiler).stats.items()
+            if function != toggling_frame and set(callers) != {toggling_frame}
+        ]
+        return cls(rows, method="cProfile")
+
+    @classmethod
+    def sample(
+        cls, stmt: str, setup="pass", run_count: int = 1, _globals=None, interval_ns: int = SAMPLING_INTERVAL_NS
+    ) -> ForwardRef("Hotspots"):
+        sampler = StackSampler(interval_ns)
+        timer_ = Timer(stmt, setup=setup, timer=perf_counter_ns, globals=_globals)
+        with sampler:
+            timer_.timeit(run_count)
+        return cls.from_stacks(sampler.stacks, sampler.sample_ns)
+
+    @classmethod
+    def from_stacks(cls, stacks: Counter, sample_ns: float) -> ForwardRef("Hotspots"):
+        self_samples = Counter()
+        cumulative_samples = Counter()
+        for stack, count in stacks.items():
+            self_samples[stack[-1]] += count
+            for frame in set(stack):
+                cumulative_samples[frame] += count
+        rows = [
+            Hotspot(frame_label(frame), self_samples[frame] * sample_ns, count * sample_ns, None)
+            for frame, count in cumulative_samples.items()
+        ]
+        return cls(rows, method="sampling", stacks=stacks, sample_ns=sample_ns)
+
+    def to_dict(self) -> dict:
+        return {
+            "rows": [asdict(row) for row in self.rows],
+            "method": self.method,
+            "stacks": [[list(map(list, stack)), count] for stack, count in self.stacks.items()],
+            "sample_ns": self.sample_ns,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> ForwardRef("Hotspots"):
+        stacks = Counter({tuple(map(tuple, stack)): count for stack, count in data["stacks"]})
+        return cls([Hotspot(**row) for row in data["rows"]], data["method"], stacks, data["sample_ns"])
+
+    def __getitem__(self, index) -> Union[Hotspot, list[Hotspot]]:
+        return self.rows[index]
+
+    def __repr__(self, limit=PROFILE_TOP) -> str:
+        rows = [("Function", "Self", "Cumulative", "Calls")]
+        for row in self.rows[:limit]:
+            rows.append(
+                (
+                    row.function,
+                    human_ns(row.self_ns),
+                    human_ns(row.cumulative_ns),
+                    "-" if row.calls is None else f"{row.calls:,}",
+                )
+            )
+        method = self.method
+        if self.method == "sampling":
+            method += f", {sum(self.stacks.values()):,} samples every {human_ns(self.sample_ns)}"
+        return f"Hotspots ({method}):\n{format_table(rows)}"
+
+
+def folded_stacks(profiles: dict[str, Hotspots]) -> str:
+    """Brendan Gregg's folded format: one `root;caller;callee count` line per distinct stack.
+    Each profile's name is the root frame, so several measurements stay apart in one graph."""
+    lines = []
+    for name, hotspots in profiles.items():
+        for stack, count in hotspots.stacks.items():
+            frames = [name, *map(frame_label, stack)]
+            lines.append(";".join(frame.replace(";", ",") for frame in frames) + f" {count}")
+    return "\n".join(lines) + "\n"
+
+
+def speedscope_profile(profiles: dict[str, Hotspots], name: str) -> dict:
+    """speedscope's file format, one "sampled" profile per entry, weighted by the wall time each sample stands for."""
+    frames = []
+    frame_indices = {}
+    shared_profiles = []
+    for profile_name, hotspots in profiles.items():
+        samples = []
+        weights = []
+        for stack, count in hotspots.stacks.items():
+            for frame in stack:
+                if frame not in frame_indices:
+                    frame_indices[frame] = len(frames)
+                    filename, line, function = frame
+                    frames.append({"name": function, "file": filename, "line": line})
+            samples.append([frame_indices[frame] for frame in stack])
+            weights.append(count * hotspots.sample_ns)
+        shared_profiles.append(
+            {
+                "type": "sampled",
+                "name": profile_name,
+                "unit": "nanoseconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }
+        )
+    return {
+        "$schema": SPEEDSCOPE_SCHEMA,
+        "name": name,
+        "exporter": "measure.py",
+        "activeProfileIndex": 0,
+        "shared": {"frames": frames},
+        "profiles": shared_profiles,
+    }
+
+
+@dataclass
+class Overhead:
+    """What timeit's loop and timer calls cost for `run_count` runs of an empty statement with the same setup.
+
+    Measured OVERHEAD_REPEATS times; `nanosec` is the fastest, `jitter` the spread between fastest and slowest.
+    A statement whose net cost doesn't exceed the jitter (or the timer's resolution) can't be told apart from the loop.
+    """
+
+    nanosec: int = 0
+    jitter: int = 0
+
+    @classmethod
+    def measure(cls, setup="pass", timer=perf_counter_ns, run_count: int = 1, _globals=None) -> ForwardRef("Overhead"):
+        empty = Timer("pass", setup=setup, timer=timer, globals=_globals)
+        timings = [empty.timeit(run_count) for _ in range(OVERHEAD_REPEATS)]
+        return cls(nanosec=min(timings), jitter=max(timings) - min(timings))
+
+    def net(self, nanosec: float) -> float:
+        return max(nanosec - self.nanosec, 0)
+
+    def is_reliable(self, nanosec: float) -> bool:
+        return nanosec - self.nanosec > max(self.jitter, TIMER_RESOLUTION_NS)
 
 
 class Measurement:
-    """Runs the statment `run_count` times."""
+    """Runs the statment `run_count` times.
+    If `memory` is True, runs them once more under tracemalloc (see MemoryUsage).
+    If `subtract_overhead` is True, also times an empty statement with the same setup and run count (see Overhead),
+    so `net_nanosec_avg` is the statement's own cost.
+    If `profile` is True, runs them once more under a profiler (see Hotspots)."""
 
     def __init__(
-        self, stmt: str, setup="pass", timer=perf_counter_ns, run_count: int = 1_000_000, _globals=None, variance=False
+        self,
+        stmt: str,
+        setup="pass",
+        timer=perf_counter_ns,
+        run_count: int = 1_000_000,
+        _globals=None,
+        variance=False,
+        memory=False,
+        subtract_overhead=True,
+        profile=False,
     ):
         self.stmt = stmt
+        self.setup = setup
         self.run_count = run_count
         print(f"\nTiming {run_count:,} runs...", end="")
-        self.nanosec_sum = timeit(stmt, setup=setup, timer=timer, number=run_count, globals=_globals)
+        probe = ResourceProbe(timer)
+        self.nanosec_sum = timeit(stmt, setup=setup, timer=probe, number=run_count, globals=_globals)
         self.nanosec_avg = self.nanosec_sum / self.run_count
+        self.resources = probe.usage(runs=run_count)
+        self.overhead = Overhead()
+        if subtract_overhead:
+            self.overhead = Overhead.measure(setup, timer=timer, run_count=run_count, _globals=_globals)
         self.stats = None
+        self.margin_of_error = None
+        self.memory = None
+        if memory:
+            self.memory = MemoryUsage.trace(stmt, setup=setup, run_count=run_count, _globals=_globals)
+        self.hotspots = None
+        if profile:
+            self.hotspots = Hotspots.profile(
+                stmt,
+                setup=setup,
+                run_count=run_count,
+                _globals=_globals,
+                sampling=self.nanosec_sum >= PROFILE_SAMPLING_THRESHOLD_NS,
+            )
 
         if variance:
             self.stats = Stats()
+            self.stats.resources = self.resources
+            self.stats.overhead = self.overhead
             if run_count == 1:
                 return
 
@@ -155,40 +861,633 @@ class Measurement:
                 timer=timer,
                 run_count=run_count,
                 nanosec_sum=self.nanosec_sum,
-                nanosec_avg=self.nanosec_avg,
                 _globals=_globals,
             )
 
+    @classmethod
+    def autoranged(
+        cls,
+        stmt: str,
+        setup="pass",
+        timer=perf_counter_ns,
+        _globals=None,
+        budget: float = DEFAULT_BUDGET,
+        rel_err: float = DEFAULT_REL_ERR,
+        memory=False,
+        subtract_overhead=True,
+        profile=False,
+    ) -> ForwardRef("Measurement"):
+        """Like timeit's autorange, but bounded by a total `budget` in seconds.
+
+        Calibrates `run_count` (1, 2, 5, 10, 20, 50, ...) until one sample takes about 1/AUTORANGE_TARGET_SAMPLES
+        of the budget, then keeps sampling until the mean's 95% confidence interval is within ±`rel_err`
+        or the budget is spent, whichever comes first."""
+        budget_ns = int(budget * 1_000_000_000)
+        deadline = perf_counter_ns() + budget_ns
+        target_ns = max(budget_ns // AUTORANGE_TARGET_SAMPLES, 1_000_000)
+
+        print(f"\nAuto-ranging within {human_ns(budget_ns, dec=0)} (target ±{fmt_num(rel_err * 100)}%)...", end="")
+        timer_ = Timer(stmt, setup=setup, timer=timer, globals=_globals)
+        run_count, nanosec = calibrate(timer_, target_ns, deadline)
+        resources_before = resource_snapshot()
+
+        stats = Stats(run_count=run_count)
+        stats.samples.append(nanosec)
+        total = nanosec
+        sum_of_squares = nanosec**2
+        margin = inf
+        while perf_counter_ns() < deadline:
+            nanosec = timer_.timeit(run_count)
+            stats.samples.append(nanosec)
+            total += nanosec
+            sum_of_squares += nanosec**2
+            margin = relative_margin_of_error(len(stats.samples), total, sum_of_squares)
+            if len(stats.samples) >= AUTORANGE_MIN_SAMPLES and margin <= rel_err:
+                break
+        stats.resources = ResourceUsage.between(
+            resources_before,
+            resource_snapshot(opening=False),
+            runs=max(run_count * (len(stats.samples) - 1), 1),  # The calibration sample was taken before `start`
+        )
+        stats.summarize()
+        print(f" {len(stats.samples):,} samples of {run_count:,} runs (±{fmt_num(margin * 100)}%)", end="")
+
+        return cls.from_stats(
+            stmt,
+            stats,
+            setup=setup,
+            timer=timer,
+            _globals=_globals,
+            memory=memory,
+            subtract_overhead=subtract_overhead,
+            profile=profile,
+        )
+
+    @classmethod
+    def from_stats(
+        cls,
+        stmt: str,
+        stats: Stats,
+        setup="pass",
+        timer=perf_counter_ns,
+        _globals=None,
+        memory=False,
+        subtract_overhead=True,
+        profile=False,
+    ) -> ForwardRef("Measurement"):
+        """A measurement whose samples were already taken (by `autoranged` or a Scheduler); runs the optional
+        overhead, memory and profile passes as __init__ does."""
+        run_count = stats.run_count
+        measurement = cls.__new__(cls)
+        measurement.stmt = stmt
+        measurement.setup = setup
+        measurement.run_count = run_count
+        measurement.nanosec_avg = stats.nanosec_avg
+        measurement.nanosec_sum = int(stats.nanosec_avg * run_count)
+        measurement.overhead = Overhead()
+        if subtract_overhead:
+            measurement.overhead = Overhead.measure(setup, timer=timer, run_count=run_count, _globals=_globals)
+        stats.overhead = measurement.overhead
+        measurement.stats = stats
+        measurement.resources = stats.resources
+        measurement.hotspots = None
+        if profile:
+            measurement.hotspots = Hotspots.profile(
+                stmt,
+                setup=setup,
+                run_count=run_count,
+                _globals=_globals,
+                sampling=measurement.nanosec_sum >= PROFILE_SAMPLING_THRESHOLD_NS,
+            )
+        measurement.margin_of_error = relative_margin_of_error(
+            len(stats.samples), sum(stats.samples), sum(map(mul, stats.samples, stats.samples))
+        )
+        measurement.memory = (
+            MemoryUsage.trace(stmt, setup=setup, run_count=run_count, _globals=_globals) if memory else None
+        )
+        return measurement
+
+    @property
+    def net_nanosec_avg(self) -> float:
+        return self.overhead.net(self.nanosec_sum) / self.run_count
+
+    @property
+    def reliable(self) -> bool:
+        """False if the statement's cost is lost in the loop overhead's jitter or below the timer's resolution."""
+        return self.overhead.is_reliable(self.nanosec_sum)
+
+    def to_dict(self) -> dict:
+        """Plain data (ints, floats, bytes), cheap to ship back from a worker process."""
+        return {
+            "stmt": self.stmt,
+            "setup": self.setup,
+            "run_count": self.run_count,
+            "nanosec_sum": self.nanosec_sum,
+            "nanosec_avg": self.nanosec_avg,
+            "margin_of_error": self.margin_of_error,
+            "stats": self.stats.to_dict() if self.stats is not None else None,
+            "memory": asdict(self.memory) if self.memory is not None else None,
+            "resources": asdict(self.resources) if self.resources is not None else None,
+            "overhead": asdict(self.overhead),
+            "hotspots": self.hotspots.to_dict() if self.hotspots is not None else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> ForwardRef("Measurement"):
+        measurement = cls.__new__(cls)
+        measurement.setup = "pass"
+        measurement.__dict__.update(data)
+        if data["stats"] is not None:
+            measurement.stats = Stats.from_dict(data["stats"])
+        if data.get("memory") is not None:
+            measurement.memory = MemoryUsage(**data["memory"])
+        else:
+            measurement.memory = None
+        if data.get("resources") is not None:
+            measurement.resources = ResourceUsage(**data["resources"])
+        else:
+            measurement.resources = None
+        measurement.overhead = Overhead(**data.get("overhead") or {})
+        measurement.hotspots = Hotspots.from_dict(data["hotspots"]) if data.get("hotspots") else None
+        if measurement.stats is not None:
+            measurement.stats.resources = measurement.resources
+            measurement.stats.overhead = measurement.overhead
+        return measurement
+
     def __repr__(self):
         if self.stats:
-            return f"\n\t" + "\n\t".join(str(self.stats).split("\n"))
+            lines = str(self.stats).split("\n")
+            if self.memory is not None:
+                lines.append(str(self.memory))
+            if self.hotspots is not None:
+                lines.extend(str(self.hotspots).split("\n"))
+            return f"\n\t" + "\n\t".join(lines)
         else:
             human_sum = human_ns(self.nanosec_sum)
             human_avg = human_ns(self.nanosec_avg)
-            return f"Avg: {human_avg} {HDIV} Total: {human_sum}"
+            line = f"Avg: {human_avg} {HDIV} Total: {human_sum}"
+            if self.overhead.nanosec:
+                net = human_ns(self.net_nanosec_avg) if self.reliable else "unreliable (below loop overhead noise)"
+                line = (
+                    f"Net avg: {net} {HDIV} {line} {HDIV} Overhead: {human_ns(self.overhead.nanosec / self.run_count)}"
+                )
+            if self.resources is not None:
+                line += f" {HDIV} {self.resources}"
+            if self.memory is not None:
+                line += f" {HDIV} {self.memory}"
+            if self.hotspots is not None:
+                line += "\n\t" + "\n\t".join(str(self.hotspots).split("\n"))
+            return line
+
+
+_event_loop = None
+
+
+def event_loop() -> asyncio.AbstractEventLoop:
+    """One event loop reused by every AsyncMeasurement (uvloop's if installed), so loop creation is paid once."""
+    global _event_loop
+    if _event_loop is None or _event_loop.is_closed():
+        try:
+            import uvloop
+
+            _event_loop = uvloop.new_event_loop()
+        except ModuleNotFoundError:
+            _event_loop = asyncio.new_event_loop()
+    return _event_loop
+
+
+class AsyncMeasurement(Measurement):
+    """Awaits `stmt` (e.g. `await client.get(url)`) `run_count` times inside one coroutine on the shared event_loop(),
+    timing every iteration separately, so `stats` holds per-await latencies rather than loop-creation cost.
+
+    `setup` runs once inside the same coroutine (so it may await too). Without `run_count`, keeps going until `budget`
+    seconds are spent. A concurrent task sleeping LOOP_LAG_INTERVAL_NS at a time measures event-loop lag:
+    how late the loop got back to it, i.e. how long the statement blocked the loop."""
+
+    def __init__(
+        self,
+        stmt: str,
+        setup="pass",
+        timer=perf_counter_ns,
+        run_count: int = None,
+        _globals=None,
+        budget: float = DEFAULT_BUDGET,
+        warmup: int = 1,
+    ):
+        self.stmt = stmt
+        self.setup = setup
+        namespace = dict(_globals or {})
+        source = "\n".join(
+            [
+                "async def __measure_async(__timer, __runs, __deadline, __warmup):",
+                textwrap.indent(setup, "    "),
+                "    __samples = []",
+                "    __i = 0",
+                "    while __i < __runs + __warmup and (__deadline is None or __timer() < __deadline):",
+                "        __t0 = __timer()",
+                textwrap.indent(stmt, "        "),
+                "        __samples.append(__timer() - __t0)",
+                "        __i += 1",
+                "    return __samples[__warmup:]",
+            ]
+        )
+        exec(compile(source, "<measure-async>", "exec"), namespace)
+        coroutine_function = namespace["__measure_async"]
+        deadline = None if run_count else perf_counter_ns() + int(budget * 1_000_000_000)
+        runs = run_count or ASYNC_MAX_RUNS
+
+        loop = event_loop()
+        self.loop_name = f"{type(loop).__module__}.{type(loop).__qualname__}"
+        print(
+            f"\nAwaiting {f'{run_count:,} runs' if run_count else f'for {human_ns(budget * 1_000_000_000, dec=0)}'} on {self.loop_name}...",
+            end="",
+        )
+
+        lags = array("q")
+
+        async def monitor_lag():
+            interval = LOOP_LAG_INTERVAL_NS / 1_000_000_000
+            while True:
+                before = perf_counter_ns()
+                await asyncio.sleep(interval)
+                lags.append(max(perf_counter_ns() - before - LOOP_LAG_INTERVAL_NS, 0))
+
+        async def drive():
+            monitor = asyncio.ensure_future(monitor_lag())
+            try:
+                return await coroutine_function(timer, runs, deadline, warmup)
+            finally:
+                monitor.cancel()
+
+        before = resource_snapshot()
+        samples = loop.run_until_complete(drive())
+        self.resources = ResourceUsage.between(before, resource_snapshot(opening=False), runs=max(len(samples), 1))
+
+        self.run_count = len(samples)
+        self.stats = Stats.from_samples(samples)
+        self.stats.resources = self.resources
+        self.nanosec_sum = self.stats.nanosec_sum or 0
+        self.nanosec_avg = self.stats.nanosec_avg or 0
+        self.loop_lag = Stats.from_samples(lags)
+        self.overhead = Overhead()
+        self.margin_of_error = None
+        self.memory = None
+        self.hotspots = None
+
+    def __repr__(self):
+        lines = [f"{self.run_count:,} awaits on {self.loop_name}", *str(self.stats).split("\n")]
+        if self.loop_lag:
+            lines.append(
+                f"Loop lag {HDIV} median {human_ns(self.loop_lag.median)} {HDIV} p99 {human_ns(self.loop_lag.percentiles[99])}"
+                f" {HDIV} max {human_ns(self.loop_lag.slowest.ns)} ({len(self.loop_lag.samples):,} ticks)"
+            )
+        return "\n".join(lines)
+
+
+@dataclass
+class Drift:
+    """What every job of a round (one batch each) had in common: the median, over jobs, of each batch's timing
+    divided by its job's median. 1.0 is no drift; a trend across rounds is thermal or frequency drift,
+    a lone spike is background noise."""
+
+    factors: list[float]
+
+    @property
+    def trend(self) -> float:
+        """Least-squares relative change from the first round to the last."""
+        count = len(self.factors)
+        if count < 2:
+            return 0.0
+        mean_x = (count - 1) / 2
+        mean_y = sum(self.factors) / count
+        slope = sum((x - mean_x) * (y - mean_y) for x, y in enumerate(self.factors)) / sum(
+            (x - mean_x) ** 2 for x in range(count)
+        )
+        return slope * (count - 1)
+
+    def __str__(self) -> str:
+        if not self.factors:
+            return "Drift: no rounds"
+        return (
+            f"Drift: {self.trend * 100:+.2f}% over {len(self.factors):,} rounds {HDIV} "
+            f"batches {fmt_num(min(self.factors) * 100)}% – {fmt_num(max(self.factors) * 100)}% of median"
+        )
+
+
+def scheduled_setup(setup: str, disable_gc: bool) -> str:
+    """timeit turns the garbage collector off while timing; its documented way to keep it on is from `setup`."""
+    return setup if disable_gc else f"__import__('gc').enable()\n{setup}"
+
+
+class Scheduler:
+    """Times several jobs (a Timer and a run count each) in rounds; every round takes one batch of each job,
+    in a freshly shuffled order, so drift and background noise are spread over all jobs instead of biasing
+    whichever runs first.
+
+    `warmup` rounds are run and thrown away first. With `disable_gc` (timeit's default) the collector is off
+    during batches and a full collection runs between rounds, outside the timings; build the timers with
+    `scheduled_setup` to match."""
+
+    def __init__(
+        self, timers: dict[str, Timer], run_counts: dict[str, int], warmup: int = WARMUP_ROUNDS, disable_gc=True
+    ):
+        self.timers = timers
+        self.run_counts = run_counts
+        self.warmup = warmup
+        self.disable_gc = disable_gc
+        self.stats = {name: Stats(run_count=run_counts[name]) for name in timers}
+        self.drift: Optional[Drift] = None
+
+    def _round(self, order: list[str]) -> dict[str, int]:
+        random.shuffle(order)
+        if self.disable_gc:
+            gc.collect()
+        return {name: self.timers[name].timeit(self.run_counts[name]) for name in order}
+
+    def run(
+        self, rounds: int = None, deadline: int = None, rel_err: float = None, min_rounds: int = COMPARISON_MIN_ROUNDS
+    ) -> dict[str, Stats]:
+        """Runs `rounds` rounds, or until `deadline` (a perf_counter_ns() value) once every job's mean is within
+        ±`rel_err` after at least `min_rounds`.
+
+        At least one round is run after the warmup even if the deadline has passed by then (calibration and warmup
+        count against it), so every job gets a sample; only `rounds=0` leaves them all empty."""
+        order = list(self.timers)
+        for _ in range(self.warmup):
+            self._round(order)
+        completed = 0
+        while (rounds is None or completed < rounds) and (
+            not completed or deadline is None or perf_counter_ns() < deadline
+        ):
+            for name, nanosec in self._round(order).items():
+                self.stats[name].samples.append(nanosec)
+            completed += 1
+            if (
+                rel_err is not None
+                and completed >= min_rounds
+                and all(
+                    relative_margin_of_error(
+                        len(stats.samples), sum(stats.samples), sum(map(mul, stats.samples, stats.samples))
+                    )
+                    <= rel_err
+                    for stats in self.stats.values()
+                )
+            ):
+                break
+        for stats in self.stats.values():
+            stats.summarize()
+        batch_medians = {name: (stats.median or 0) * stats.run_count or 1 for name, stats in self.stats.items()}
+        self.drift = Drift(
+            [
+                percentile(sorted(stats.samples[i] / batch_medians[name] for name, stats in self.stats.items()), 50)
+                for i in range(completed)
+            ]
+        )
+        return self.stats
+
+
+_free_cpus = None
+
+
+def _init_isolated_worker(free_cpus):
+    global _free_cpus
+    _free_cpus = free_cpus
+
+
+def _isolated_measurement(kwargs: dict, autorange: bool) -> dict:
+    """Runs in a fresh worker process. If the pool was given CPUs to pin to, holds one of them for the duration."""
+    cpu = None
+    if _free_cpus is not None:
+        cpu = _free_cpus.get()
+        os.sched_setaffinity(0, {cpu})
+    try:
+        gc.collect()
+        if autorange:
+            return Measurement.autoranged(**kwargs).to_dict()
+        return Measurement(**kwargs).to_dict()
+    finally:
+        if cpu is not None:
+            _free_cpus.put(cpu)
+
+
+def pyplot():
+    """matplotlib.pyplot with IPython's matplotlib integration enabled, or None if matplotlib isn't installed."""
+    try:
+        get_ipython().enable_matplotlib()
+    except ModuleNotFoundError as e:
+        print(
+            "[WARNING][measure.py] ModuleNotFoundError when ipython.enable_matplotlib(). Experiment.plot() will not work."
+        )
+        return None
+    from matplotlib import pyplot as plt
+
+    return plt
 
 
 class Experiment:
-    """Runs len(runs_counts) measurements"""
+    """Runs len(runs_counts) measurements, or a single auto-ranged one if `autorange` is True."""
+
+    def __init__(
+        self,
+        stmt: str,
+        runs_counts: Iterable[int] = DEFAULT_RUNS_COUNTS,
+        setup="pass",
+        _globals=None,
+        variance=False,
+        autorange=False,
+        budget: float = DEFAULT_BUDGET,
+        rel_err: float = DEFAULT_REL_ERR,
+        isolate=False,
+        workers: int = 1,
+        pin=False,
+        memory=False,
+        profile=False,
+        interleave=False,
+        rounds: int = INTERLEAVE_ROUNDS,
+        warmup: int = WARMUP_ROUNDS,
+        disable_gc=True,
+    ):
+        """If `isolate` is True, each measurement runs in a fresh spawned process (so only `setup` is available
+        to `stmt`, not `_globals`), up to `workers` at a time; `pin` pins each worker to its own CPU.
+        If `interleave` is True, all run counts are sampled together on a Scheduler, `rounds` times or as many
+        as fit in `budget` seconds, and the experiment's `drift` shows how much the machine drifted meanwhile."""
+        self._init_storage(stmt, setup, variance=variance or autorange or interleave, memory=memory, _globals=_globals)
+        if isolate:
+            if autorange:
+                kwargs_list = [
+                    dict(stmt=stmt, setup=setup, budget=budget, rel_err=rel_err, memory=memory, profile=profile)
+                ]
+            else:
+                kwargs_list = [
+                    dict(stmt=stmt, setup=setup, run_count=run_count, variance=variance, memory=memory, profile=profile)
+                    for run_count in runs_counts
+                ]
+            measurements = self._run_isolated(kwargs_list, autorange=autorange, workers=workers, pin=pin)
+        elif autorange:
+            measurements = [
+                Measurement.autoranged(
+                    stmt,
+                    setup=setup,
+                    _globals=_globals,
+                    budget=budget,
+                    rel_err=rel_err,
+                    memory=memory,
+                    profile=profile,
+                )
+            ]
+        elif interleave:
+            measurements = self._run_interleaved(
+                runs_counts,
+                budget=budget,
+                rounds=rounds,
+                warmup=warmup,
+                disable_gc=disable_gc,
+                memory=memory,
+                profile=profile,
+            )
+        else:
+            measurements = (
+                Measurement(
+                    stmt,
+                    setup=setup,
+                    run_count=run_count,
+                    _globals=_globals,
+                    variance=variance,
+                    memory=memory,
+                    profile=profile,
+                )
+                for run_count in runs_counts
+            )
+        for measurement in measurements:
+            self._add(measurement)
 
-    def __init__(self, stmt: str, runs_counts: Iterable[int], setup="pass", _globals=None, variance=False):
-        self.measurements: dict[str, Measurement] = {}
-        self.runs_counts: list[int] = []
-        self.nanosec_avgs: list[int] = []
-        self.stats_arr: list[Stats] = []
+    def _init_storage(self, stmt: str, setup: str, *, variance: bool, memory: bool, _globals=None):
+        self.stmt = stmt
+        self.setup = setup
+        self._globals = _globals
+        # Columns, one row per measurement. Slices share them and only keep their own `_rows`.
+        self._keys: list[str] = []
+        self._measurements: list[Measurement] = []
+        self._runs_counts = array("q")
+        self._nanosec_avgs = array("d")
+        self._net_nanosec_avgs = array("d")
+        self._rows: Optional[range] = None  # None: every row, including ones added later
         self.variance = variance
-        for run_count in runs_counts:
-            key = f"{run_count:,}"
-            measurement = Measurement(stmt, setup=setup, run_count=run_count, _globals=_globals, variance=variance)
-            self.runs_counts.append(measurement.run_count)
-            self.nanosec_avgs.append(measurement.nanosec_avg)
-            if variance:
-                self.stats_arr.append(measurement.stats)
-            self.measurements[key] = measurement
+        self.memory = memory
+        self.drift: Optional[Drift] = None
+
+    def _run_interleaved(
+        self, runs_counts: Iterable[int], *, budget: float, rounds: int, warmup: int, disable_gc: bool, memory, profile
+    ) -> list[Measurement]:
+        run_counts = {f"{run_count:,}": run_count for run_count in runs_counts}
+        setup = scheduled_setup(self.setup, disable_gc)
+        timers = {
+            key: Timer(self.stmt, setup=setup, timer=perf_counter_ns, globals=self._globals) for key in run_counts
+        }
+        print(f"\nInterleaving {len(run_counts)} run counts over {rounds:,} rounds...", end="")
+        scheduler = Scheduler(timers, run_counts, warmup=warmup, disable_gc=disable_gc)
+        scheduler.run(rounds=rounds, deadline=perf_counter_ns() + int(budget * 1_000_000_000))
+        self.drift = scheduler.drift
+        print(f" {len(self.drift.factors):,} done", end="")
+        if not self.drift.factors:
+            print("\n[WARNING][measure.py] No interleaved rounds were run; there are no measurements.")
+        return [
+            Measurement.from_stats(
+                self.stmt, stats, setup=self.setup, _globals=self._globals, memory=memory, profile=profile
+            )
+            for stats in scheduler.stats.values()
+            if stats
+        ]
+
+    def _add(self, measurement: Measurement, key: str = None):
+        self._measurements.append(measurement)
+        self._runs_counts.append(measurement.run_count)
+        self._nanosec_avgs.append(measurement.nanosec_avg)
+        self._net_nanosec_avgs.append(measurement.net_nanosec_avg)
+        # Last: `rows` counts `_keys`, so a reader on another thread (see BackgroundExperiment) never sees a row
+        # whose other columns aren't there yet.
+        self._keys.append(key or f"{measurement.run_count:,}")
+
+    @property
+    def rows(self) -> range:
+        return range(len(self._keys)) if self._rows is None else self._rows
+
+    @property
+    def measurements(self) -> dict[str, Measurement]:
+        return {self._keys[row]: self._measurements[row] for row in self.rows}
+
+    @property
+    def runs_counts(self) -> list[int]:
+        return [self._runs_counts[row] for row in self.rows]
+
+    @property
+    def nanosec_avgs(self) -> list[float]:
+        return [self._nanosec_avgs[row] for row in self.rows]
+
+    @property
+    def net_nanosec_avgs(self) -> list[float]:
+        return [self._net_nanosec_avgs[row] for row in self.rows]
+
+    @property
+    def stats_arr(self) -> list[Stats]:
+        return [self._measurements[row].stats for row in self.rows] if self.variance else []
+
+    @property
+    def memory_arr(self) -> list[MemoryUsage]:
+        return [self._measurements[row].memory for row in self.rows] if self.memory else []
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def to_dict(self) -> dict:
+        return {
+            "stmt": self.stmt,
+            "setup": self.setup,
+            "variance": self.variance,
+            "memory": self.memory,
+            "measurements": [measurement.to_dict() for measurement in self.measurements.values()],
+            "drift": self.drift.factors if self.drift is not None else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> ForwardRef("Experiment"):
+        experiment = cls.__new__(cls)
+        experiment._init_storage(
+            data["stmt"], data["setup"], variance=data["variance"], memory=data.get("memory", False)
+        )
+        for measurement_data in data["measurements"]:
+            experiment._add(Measurement.from_dict(measurement_data))
+        if data.get("drift") is not None:
+            experiment.drift = Drift(data["drift"])
+        return experiment
+
+    @staticmethod
+    def _run_isolated(kwargs_list: list[dict], *, autorange: bool, workers: int, pin: bool) -> list[Measurement]:
+        context = multiprocessing.get_context("spawn")
+        free_cpus = None
+        if pin:
+            if not hasattr(os, "sched_setaffinity"):
+                print("[WARNING][measure.py] os.sched_setaffinity is not available on this platform; not pinning.")
+            else:
+                cpus = sorted(os.sched_getaffinity(0))
+                workers = min(workers, len(cpus))
+                free_cpus = context.Queue()
+                for cpu in cpus:
+                    free_cpus.put(cpu)
+        print(f"\nRunning {len(kwargs_list)} isolated measurement(s) on {workers} worker(s)...", end="")
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=_init_isolated_worker,
+            initargs=(free_cpus,),
+            max_tasks_per_child=1,
+        ) as pool:
+            results = pool.map(_isolated_measurement, kwargs_list, [autorange] * len(kwargs_list))
+            return [Measurement.from_dict(data) for data in results]
 
     def __repr__(self) -> str:
-        lines = []
-        ljust = get_justification(*self.measurements.keys()) + 5
+        lines = [] if self.measurements else ["No measurements"]
+        ljust = get_justification("", *self.measurements.keys()) + 5
         for key, measurement in self.measurements.items():
             measurement_str = str(measurement)
             if measurement_str.startswith("\n"):
@@ -196,42 +1495,1182 @@ class Experiment:
             else:
                 runs = f"{key} runs {HDIV}"
             lines.append(f"{runs} {measurement_str}")
+        if self.drift is not None:
+            lines.append(str(self.drift))
         return "\n".join(lines)
 
-    def __getitem__(self, slice_or_index: Union[int, slice]) -> ForwardRef("Experiment"):
-        if isinstance(slice_or_index, (str, int)):
-            if isinstance(slice_or_index, str):
-                key = slice_or_index
-            else:
-                key = list(self.measurements.keys())[slice_or_index]
-            measurement = self.measurements[key]
-            return measurement
+    def __getitem__(self, slice_or_index: Union[int, str, slice]) -> Union[Measurement, ForwardRef("Experiment")]:
+        if isinstance(slice_or_index, str):
+            return self.measurements[slice_or_index]
+        if isinstance(slice_or_index, int):
+            return self._measurements[self.rows[slice_or_index]]
+        # A view: shares every column (and anything else set on self), only narrowing the rows.
+        view = self.__class__.__new__(self.__class__)
+        view.__dict__.update(self.__dict__)
+        view._rows = self.rows[slice_or_index]
+        return view
 
-        else:
-            copy = deepcopy(self)
-            copy.measurements.clear()
-            # slice
-            for key in list(self.measurements.keys())[slice_or_index]:
-                copy.measurements[key] = self.measurements[key]
-            copy.runs_counts = self.runs_counts[slice_or_index]
-            copy.nanosec_avgs = self.nanosec_avgs[slice_or_index]
-            copy.stats_arr = self.stats_arr[slice_or_index]
-            return copy
+    def flamegraph(self, path: Union[str, Path], min_duration_ns: int = FLAMEGRAPH_MIN_NS) -> list[Path]:
+        """Writes the measurements' stack samples as `path`.folded (for flamegraph.pl or inferno) and
+        `path`.speedscope.json (for speedscope, which also opens offline), and returns both paths.
+
+        Uses the samples of measurements taken with `profile` on. If there are none (not profiled, or short enough
+        to be profiled by cProfile), first samples the last measurement again for at least `min_duration_ns`."""
+        profiles = {
+            f"{key} runs": measurement.hotspots
+            for key, measurement in self.measurements.items()
+            if measurement.hotspots is not None and measurement.hotspots.stacks
+        }
+        if not profiles:
+            measurement = list(self.measurements.values())[-1]
+            run_count = max(measurement.run_count, ceil(min_duration_ns / max(measurement.nanosec_avg, 1)))
+            print(f"\nSampling {run_count:,} runs for a flamegraph...", end="")
+            hotspots = Hotspots.sample(self.stmt, measurement.setup, run_count=run_count, _globals=self._globals)
+            profiles = {f"{run_count:,} runs": hotspots}
+
+        path = Path(path)
+        folded_path = path.with_suffix(".folded")
+        speedscope_path = path.with_suffix(".speedscope.json")
+        folded_path.write_text(folded_stacks(profiles))
+        speedscope_path.write_text(json.dumps(speedscope_profile(profiles, name=self.stmt)))
+        print(f"\nWrote {folded_path} and {speedscope_path}")
+        return [folded_path, speedscope_path]
 
     def plot(self):
-        try:
-            ipython.enable_matplotlib()
-        except ModuleNotFoundError as e:
-            print(
-                "[WARNING][measure.py] ModuleNotFoundError when ipython.enable_matplotlib(). Experiment.plot() will not work."
-            )
+        plt = pyplot()
+        if not plt:
             return False
-        from matplotlib import pyplot as plt
 
         plt.xlabel("Repeats")
         plt.ylabel("Nanoseconds")
         runs_pretty = list(map(lambda n: f"{n:,}", self.runs_counts))
-        return plt.plot(runs_pretty, self.nanosec_avgs)
+        lines = plt.plot(runs_pretty, self.nanosec_avgs, label="Avg")
+        if any(measurement.overhead.nanosec for measurement in self.measurements.values()):
+            lines += plt.plot(runs_pretty, self.net_nanosec_avgs, "-.", label="Net of loop overhead")
+            plt.legend()
+        if self.memory_arr:
+            memory_axes = plt.gca().twinx()
+            memory_axes.set_ylabel("Bytes")
+            lines += memory_axes.plot(
+                runs_pretty, [memory.peak_bytes for memory in self.memory_arr], "--", label="Peak traced"
+            )
+            lines += memory_axes.plot(
+                runs_pretty, [memory.retained_bytes for memory in self.memory_arr], ":", label="Retained"
+            )
+            memory_axes.legend()
+        return lines
+
+
+def _background_worker(kwargs: dict, runs_counts: list[int], autorange: bool, events):
+    """Runs in a spawned process; puts each measurement on `events` as soon as it's done."""
+    sys.stdout = open(os.devnull, "w")  # "Timing N runs..." would scribble over the prompt
+    for run_count in [None] if autorange else runs_counts:
+        events.put(("timing", run_count))
+        try:
+            if autorange:
+                measurement = Measurement.autoranged(**kwargs)
+            else:
+                measurement = Measurement(run_count=run_count, **kwargs)
+        except Exception as e:
+            events.put(("failed", f"{e.__class__.__name__}: {e}"))
+            return
+        events.put(("measurement", measurement.to_dict()))
+    events.put(("done", None))
+
+
+_background_experiments: list[ForwardRef("BackgroundExperiment")] = []
+
+
+def background_toolbar() -> str:
+    return "   ".join(experiment.progress for experiment in _background_experiments)
+
+
+def refresh_toolbar():
+    """Shows background experiments in the prompt's bottom toolbar while there are any, redrawing it every second
+    while one is running. No-op outside a prompt_toolkit shell."""
+    pt_app = getattr(get_ipython(), "pt_app", None)
+    if pt_app is None:
+        return
+    pt_app.bottom_toolbar = background_toolbar if _background_experiments else None
+    pt_app.refresh_interval = 1 if any(experiment.running for experiment in _background_experiments) else 0
+    if pt_app.app.is_running:
+        pt_app.app.invalidate()
+
+
+def forget_finished_experiments(*_):
+    """post_run_cell hook: finished experiments stay in the toolbar until the next cell runs."""
+    _background_experiments[:] = [experiment for experiment in _background_experiments if experiment.running]
+    refresh_toolbar()
+
+
+class BackgroundExperiment(Experiment):
+    """An Experiment that runs in a spawned worker process and is returned right away.
+
+    Measurements show up in it as they finish, so it can be printed, sliced or plotted midway; `cancel()` stops
+    the worker and keeps what's done, `wait()` blocks until it's over. Progress shows in the prompt's toolbar.
+    Like `isolate`, only `setup` is available to `stmt`."""
+
+    def __init__(
+        self,
+        stmt: str,
+        runs_counts: Iterable[int] = DEFAULT_RUNS_COUNTS,
+        setup="pass",
+        variance=False,
+        autorange=False,
+        budget: float = DEFAULT_BUDGET,
+        rel_err: float = DEFAULT_REL_ERR,
+        memory=False,
+        profile=False,
+    ):
+        self._init_storage(stmt, setup, variance=variance or autorange, memory=memory)
+        runs_counts = list(runs_counts)
+        self.total = 1 if autorange else len(runs_counts)
+        self.status = "starting"
+        self.timing: Optional[int] = None  # Run count being timed, None if auto-ranging
+        self.error: Optional[str] = None
+        self.started = time()
+        kwargs = dict(stmt=stmt, setup=setup, memory=memory, profile=profile)
+        if autorange:
+            kwargs.update(budget=budget, rel_err=rel_err)
+        else:
+            kwargs.update(variance=variance)
+        context = multiprocessing.get_context("spawn")
+        self._events = context.Queue()
+        self._process = context.Process(
+            target=_background_worker, args=(kwargs, runs_counts, autorange, self._events), daemon=True
+        )
+        self._process.start()
+        self._listener = threading.Thread(target=self._listen, daemon=True)
+        self._listener.start()
+        _background_experiments.append(self)
+        refresh_toolbar()
+
+    def _listen(self):
+        while self.running:
+            try:
+                event, payload = self._events.get(timeout=BACKGROUND_POLL_SEC)
+            except queue.Empty:
+                if not self._process.is_alive() and self.running:
+                    self.status = "failed"
+                    self.error = f"worker exited with code {self._process.exitcode}"
+                    refresh_toolbar()
+                continue
+            if event == "timing":
+                self.status = "running"
+                self.timing = payload
+            elif event == "measurement":
+                self._add(Measurement.from_dict(payload))
+            elif event == "failed":
+                self.status = "failed"
+                self.error = payload
+            elif event == "done":
+                self.status = "done"
+            refresh_toolbar()
+        self._process.join()
+
+    @property
+    def running(self) -> bool:
+        return self.status in ("starting", "running")
+
+    @property
+    def progress(self) -> str:
+        label = textwrap.shorten(self.stmt, 30, placeholder="…")
+        elapsed = human_ns((time() - self.started) * 1_000_000_000, dec=0)
+        done = f"{len(self.measurements)}/{self.total}"
+        if self.status == "running":
+            timing = "auto-ranging" if self.timing is None else f"timing {self.timing:,} runs"
+            return f"⏱ {label}: {done}, {timing} ({elapsed})"
+        if self.status == "failed":
+            return f"✗ {label}: {done}, {self.error}"
+        return f"{'✓' if self.status == 'done' else '■'} {label}: {done} {self.status}"
+
+    def wait(self, timeout: float = None) -> ForwardRef("BackgroundExperiment"):
+        self._listener.join(timeout)
+        return self
+
+    def cancel(self) -> ForwardRef("BackgroundExperiment"):
+        if self.running:
+            self.status = "cancelled"
+            self._process.terminate()
+            self._listener.join()
+            refresh_toolbar()
+        return self
+
+    def __getitem__(self, slice_or_index: Union[int, slice, str]) -> Union[Measurement, Experiment]:
+        item = super().__getitem__(slice_or_index)
+        if isinstance(item, BackgroundExperiment):
+            item.__class__ = Experiment  # A view of the rows done so far, without the worker's controls
+        return item
+
+    def __repr__(self) -> str:
+        if not self.measurements:
+            return self.progress
+        return f"{self.progress}\n{super().__repr__()}"
+
+
+COMPLEXITY_MODELS = {
+    "O(1)": lambda n: 0.0,
+    "O(log n)": lambda n: log(n),
+    "O(n)": lambda n: n,
+    "O(n log n)": lambda n: n * log(n),
+    "O(n²)": lambda n: n * n,
+}
+COMPLEXITY_MIN_SIZES = 3
+COMPLEXITY_NOISE = 0.05  # RMS relative error a simpler model may give up over the best fit
+
+
+@dataclass
+class ComplexityFit:
+    """y ≈ intercept + slope * model(n), fitted by least squares on relative error."""
+
+    model: str
+    intercept: float
+    slope: float
+    residual: float  # RMS relative error of the fit
+
+    def __call__(self, n: float) -> float:
+        return self.intercept + self.slope * COMPLEXITY_MODELS[self.model](n)
+
+
+def fit_complexity(sizes: list[float], values: list[float]) -> list[ComplexityFit]:
+    """Fits every model in COMPLEXITY_MODELS to (sizes, values) and returns them best-first.
+
+    Weighted least squares with weights 1/value² (i.e. minimizing relative error), so small sizes count as much
+    as large ones across decades. Models whose best fit needs a negative slope are dropped.
+
+    Every model but O(1) has an extra parameter, so it always fits at least as well; the best is therefore the
+    simplest model (in COMPLEXITY_MODELS' order) within COMPLEXITY_NOISE of the smallest residual, and the rest
+    follow by residual. Two sizes fit any model exactly, so fewer than COMPLEXITY_MIN_SIZES return no fits."""
+    if len(set(sizes)) < COMPLEXITY_MIN_SIZES:
+        return []
+    fits = []
+    weights = [1 / value**2 if value else 0.0 for value in values]
+    for name, model in COMPLEXITY_MODELS.items():
+        xs = [model(size) for size in sizes]
+        sw = sum(weights)
+        swx = sum(map(mul, weights, xs))
+        swxx = sum(w * x * x for w, x in zip(weights, xs))
+        swy = sum(map(mul, weights, values))
+        swxy = sum(w * x * y for w, x, y in zip(weights, xs, values))
+        determinant = sw * swxx - swx**2
+        if abs(determinant) <= 1e-12 * max(sw * swxx, 1e-300):
+            slope = 0.0
+        else:
+            slope = (sw * swxy - swx * swy) / determinant
+        if slope < 0:
+            continue
+        intercept = (swy - slope * swx) / sw
+        residual = (
+            sum(w * (y - intercept - slope * x) ** 2 for w, x, y in zip(weights, xs, values)) / len(values)
+        ) ** 0.5
+        fits.append(ComplexityFit(name, intercept, slope, residual))
+    smallest = min(fit.residual for fit in fits)
+    simplest = next(fit for fit in fits if fit.residual <= smallest + COMPLEXITY_NOISE)
+    return [simplest, *sorted((fit for fit in fits if fit is not simplest), key=lambda fit: fit.residual)]
+
+
+class Sweep(Experiment):
+    """Measures `stmt` once per value of a single parameter, e.g. n=10,100,1000, and fits its growth.
+    Sizes must be positive integers.
+
+    `name = value` is prepended to `setup` for every value. Each size gets an auto-ranged measurement
+    (an equal share of `budget`) plus a memory pass, and both timings and peak memory are fitted
+    against COMPLEXITY_MODELS."""
+
+    def __init__(
+        self,
+        stmt: str,
+        param: tuple[str, list[int]],
+        setup="pass",
+        _globals=None,
+        budget: float = DEFAULT_BUDGET,
+        rel_err: float = DEFAULT_REL_ERR,
+    ):
+        if min(param[1]) < 1:
+            # Checked before measuring anything: fitting O(log n) and O(n log n) needs positive sizes.
+            raise ValueError(f"{param[0]} sizes must be at least 1, got {', '.join(map(str, param[1]))}")
+        self._init_storage(stmt, setup, variance=True, memory=True, _globals=_globals)
+        self.param, self.sizes = param[0], list(param[1])
+        for size in self.sizes:
+            measurement = Measurement.autoranged(
+                stmt,
+                setup=f"{self.param} = {size!r}\n{setup}",
+                _globals=_globals,
+                budget=budget / len(self.sizes),
+                rel_err=rel_err,
+                memory=True,
+            )
+            self._add(measurement, key=f"{self.param}={size:,}")
+        self.fit()
+
+    def fit(self):
+        self.fits = fit_complexity(self.sizes, self.nanosec_avgs)
+        self.memory_fits = fit_complexity(self.sizes, [max(memory.peak_bytes, 1) for memory in self.memory_arr])
+
+    @property
+    def complexity(self) -> str:
+        return self.fits[0].model if self.fits else "?"
+
+    @property
+    def memory_complexity(self) -> str:
+        return self.memory_fits[0].model if self.memory_fits else "?"
+
+    def __getitem__(self, slice_or_index: Union[int, slice]) -> ForwardRef("Sweep"):
+        item = super().__getitem__(slice_or_index)
+        if isinstance(item, Sweep):
+            item.sizes = self.sizes[slice_or_index]
+            item.fit()
+        return item
+
+    def __repr__(self) -> str:
+        ljust = get_justification(*self.measurements.keys())
+        lines = [
+            f"{key.ljust(ljust)} {HDIV} Avg: {human_ns(measurement.nanosec_avg)} {HDIV} {measurement.memory}"
+            for key, measurement in self.measurements.items()
+        ]
+        lines.append("")
+        if not self.fits:
+            lines.append(f"Complexity: ? {HDIV} fitting needs at least {COMPLEXITY_MIN_SIZES} sizes")
+            return "\n".join(lines)
+        for label, fits in (("Time", self.fits), ("Peak memory", self.memory_fits)):
+            ranked = ", ".join(f"{fit.model} (±{fmt_num(fit.residual * 100)}%)" for fit in fits[:3])
+            lines.append(f"{label}: {fits[0].model if fits else '?'} {HDIV} best fits: {ranked}")
+        return "\n".join(lines)
+
+    def plot(self):
+        plt = pyplot()
+        if not plt:
+            return False
+
+        plt.xscale("log")
+        plt.yscale("log")
+        plt.xlabel(self.param)
+        plt.ylabel("Nanoseconds")
+        lines = plt.plot(self.sizes, self.nanosec_avgs, "o-", label="Measured")
+        if self.fits:
+            best = self.fits[0]
+            lines += plt.plot(
+                self.sizes, [max(best(size), 1e-3) for size in self.sizes], "--", label=f"{best.model} fit"
+            )
+        memory_axes = plt.gca().twinx()
+        memory_axes.set_yscale("log")
+        memory_axes.set_ylabel("Peak bytes")
+        lines += memory_axes.plot(
+            self.sizes,
+            [max(memory.peak_bytes, 1) for memory in self.memory_arr],
+            ":",
+            color="gray",
+            label="Peak memory",
+        )
+        plt.legend(lines, [line.get_label() for line in lines])
+        return lines
+
+
+def compile_batch_loop(stmt: str, setup="pass", namespace: dict = None):
+    """Compiles a function that runs `setup` once, then runs `stmt` in batches of `batch` until `deadline`
+    (a perf_counter_ns() value), appending each batch's duration to `samples`."""
+    namespace = dict(namespace or {})
+    source = "\n".join(
+        [
+            "def __batch_loop(__timer, __batch, __deadline, __samples):",
+            textwrap.indent(setup, "    "),
+            "    while __timer() < __deadline:",
+            "        __t0 = __timer()",
+            "        for __i in range(__batch):",
+            textwrap.indent(stmt, "            "),
+            "        __samples.append(__timer() - __t0)",
+        ]
+    )
+    exec(compile(source, "<measure-batch-loop>", "exec"), namespace)
+    return namespace["__batch_loop"]
+
+
+_start_barrier = None
+
+
+def _init_scale_worker(barrier):
+    global _start_barrier
+    _start_barrier = barrier
+
+
+def _scale_worker(stmt: str, setup: str, batch: int, duration_ns: int) -> bytes:
+    """Runs in a worker thread or process. Waits for every other worker, then runs batches for `duration_ns`."""
+    batch_loop = compile_batch_loop(stmt, setup)
+    samples = array("q")
+    _start_barrier.wait()
+    batch_loop(perf_counter_ns, batch, perf_counter_ns() + duration_ns, samples)
+    return samples.tobytes()
+
+
+@dataclass
+class ScalePoint:
+    mode: str  # "threads" or "processes"
+    workers: int
+    duration_ns: int
+    per_worker: list  # Stats of each worker's batches; per-run values are per-op latencies
+    efficiency: float = 1.0  # ops_per_sec / (workers * ops_per_sec with 1 worker)
+
+    @property
+    def ops(self) -> int:
+        return sum(len(stats.samples) * stats.run_count for stats in self.per_worker)
+
+    @property
+    def ops_per_sec(self) -> float:
+        return self.ops * 1_000_000_000 / self.duration_ns
+
+    @property
+    def latency(self) -> Stats:
+        """Per-op latency across all workers."""
+        return Stats.from_samples(
+            chain.from_iterable(stats.samples for stats in self.per_worker), run_count=self.per_worker[0].run_count
+        )
+
+
+class Scaling:
+    """Throughput of `stmt` run concurrently by N threads, and separately by N processes, for every N in `workers`.
+
+    Every worker runs `setup` once, waits on a barrier, then runs `stmt` in batches (calibrated once, so one batch takes
+    about SCALE_BATCH_NS) for an equal share of `budget`. Efficiency is throughput relative to N times the
+    single-worker throughput of the same mode: ~1 scales, ~1/N is serialized (GIL-bound), below 1/N is contended.
+
+    Not an Experiment: its rows are ScalePoints (one per mode and worker count), not measurements of run counts."""
+
+    def __init__(self, stmt: str, workers: Iterable[int] = (1, 2, 4, 8), setup="pass", budget: float = DEFAULT_BUDGET):
+        self.stmt = stmt
+        self.setup = setup
+        self.workers = sorted(set(workers) | {1})
+        self.points: list[ScalePoint] = []
+        duration_ns = max(int(budget * 1_000_000_000 / (2 * len(self.workers))), SCALE_MIN_DURATION_NS)
+        self.batch, _ = calibrate(
+            Timer(stmt, setup=setup, timer=perf_counter_ns), SCALE_BATCH_NS, perf_counter_ns() + duration_ns
+        )
+        print(f"\nScaling in batches of {self.batch:,} runs, {human_ns(duration_ns, dec=0)} per point...", end="")
+        for mode in ("threads", "processes"):
+            for count in self.workers:
+                print(f"\n{count} {mode}...", end="")
+                if mode == "threads":
+                    context = threading
+                    pool = ThreadPoolExecutor(
+                        max_workers=count, initializer=_init_scale_worker, initargs=(threading.Barrier(count),)
+                    )
+                else:
+                    context = multiprocessing.get_context("spawn")
+                    pool = ProcessPoolExecutor(
+                        max_workers=count,
+                        mp_context=context,
+                        initializer=_init_scale_worker,
+                        initargs=(context.Barrier(count),),
+                    )
+                with pool:
+                    futures = [pool.submit(_scale_worker, stmt, setup, self.batch, duration_ns) for _ in range(count)]
+                    per_worker = [
+                        Stats.from_dict({"samples": future.result(), "run_count": self.batch}) for future in futures
+                    ]
+                self.points.append(ScalePoint(mode, count, duration_ns, per_worker))
+        for point in self.points:
+            single = next(p for p in self.points if p.mode == point.mode and p.workers == 1)
+            point.efficiency = point.ops_per_sec / (point.workers * single.ops_per_sec) if single.ops_per_sec else 0.0
+
+    def efficiency(self, mode: str) -> list[float]:
+        return [point.efficiency for point in self.points if point.mode == mode]
+
+    @property
+    def verdict(self) -> str:
+        threads, processes = self.points[len(self.workers) - 1], self.points[-1]
+        if len(self.workers) < 2:
+            return "need more than one worker count"
+        if threads.efficiency >= SCALE_EFFICIENT:
+            return "scales with threads"
+        if threads.efficiency * threads.workers < 1 - SCALE_EFFICIENT / 2:
+            return "lock-contended (threads slower than one thread)"
+        if processes.efficiency >= SCALE_EFFICIENT:
+            return "GIL-bound (scales with processes, not threads)"
+        return "doesn't scale (shared resource or too few cores)"
+
+    def __getitem__(self, index: int) -> ScalePoint:
+        return self.points[index]
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def __repr__(self) -> str:
+        rows = [("Mode", "N", "Ops/sec", "Efficiency", "p50", "p95", "p99")]
+        for point in self.points:
+            latency = point.latency
+            rows.append(
+                (
+                    point.mode,
+                    str(point.workers),
+                    fmt_num(round(point.ops_per_sec), 0) if point.ops_per_sec >= 100 else fmt_num(point.ops_per_sec),
+                    f"{fmt_num(point.efficiency * 100)}%",
+                    human_ns(latency.median),
+                    human_ns(latency.percentiles[95]),
+                    human_ns(latency.percentiles[99]),
+                )
+            )
+        return f"{format_table(rows)}\n\nVerdict: {self.verdict} ({os.cpu_count()} CPUs)"
+
+    def plot(self):
+        plt = pyplot()
+        if not plt:
+            return False
+
+        plt.xlabel("Workers")
+        plt.ylabel("Ops/sec")
+        lines = []
+        for mode in ("threads", "processes"):
+            points = [point for point in self.points if point.mode == mode]
+            lines += plt.plot(
+                [point.workers for point in points], [point.ops_per_sec for point in points], "o-", label=mode
+            )
+        single = self.points[0].ops_per_sec
+        lines += plt.plot(self.workers, [single * count for count in self.workers], ":", color="gray", label="Linear")
+        plt.legend()
+        return lines
+
+
+def statement_hash(stmt: str, setup: str) -> str:
+    return hashlib.sha256(f"{stmt}\0{setup}".encode()).hexdigest()
+
+
+def host_info() -> dict:
+    return {
+        "node": platform.node(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "system": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+class History:
+    """Experiments persisted to a local SQLite database, keyed by a hash of (stmt, setup)."""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS experiments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        stmt_hash TEXT NOT NULL,
+        stmt TEXT NOT NULL,
+        setup TEXT NOT NULL,
+        created REAL NOT NULL,
+        python TEXT NOT NULL,
+        host TEXT NOT NULL,
+        variance INTEGER NOT NULL,
+        runs_counts TEXT NOT NULL,
+        nanosec_avgs TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS experiments_stmt_hash ON experiments (stmt_hash, created);
+    CREATE TABLE IF NOT EXISTS measurements (
+        experiment_id INTEGER NOT NULL REFERENCES experiments (id) ON DELETE CASCADE,
+        position INTEGER NOT NULL,
+        run_count INTEGER NOT NULL,
+        nanosec_sum INTEGER NOT NULL,
+        nanosec_avg REAL NOT NULL,
+        margin_of_error REAL,
+        stats_run_count INTEGER,
+        samples BLOB,
+        PRIMARY KEY (experiment_id, position)
+    );
+    """
+
+    def __init__(self, path: Union[str, Path] = None):
+        self.path = Path(path or Path(get_ipython_dir()) / "measure_history.sqlite3")
+        self.connection = sqlite3.connect(self.path)
+        self.connection.executescript(self.SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self) -> ForwardRef("History"):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def save(self, experiment: "Experiment") -> int:
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO experiments (stmt_hash, stmt, setup, created, python, host, variance, runs_counts, nanosec_avgs)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    statement_hash(experiment.stmt, experiment.setup),
+                    experiment.stmt,
+                    experiment.setup,
+                    time(),
+                    sys.version,
+                    json.dumps(host_info()),
+                    experiment.variance,
+                    json.dumps(list(experiment.runs_counts)),
+                    json.dumps(list(experiment.nanosec_avgs)),
+                ),
+            )
+            experiment_id = cursor.lastrowid
+            self.connection.executemany(
+                "INSERT INTO measurements VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (
+                        experiment_id,
+                        position,
+                        measurement.run_count,
+                        measurement.nanosec_sum,
+                        measurement.nanosec_avg,
+                        measurement.margin_of_error,
+                        measurement.stats.run_count if measurement.stats is not None else None,
+                        measurement.stats.samples.tobytes() if measurement.stats is not None else None,
+                    )
+                    for position, measurement in enumerate(experiment.measurements.values())
+                ),
+            )
+        return experiment_id
+
+    def load(self, experiment_id: int) -> "Experiment":
+        stmt, setup, variance = self.connection.execute(
+            "SELECT stmt, setup, variance FROM experiments WHERE id = ?", (experiment_id,)
+        ).fetchone()
+        rows = self.connection.execute(
+            "SELECT run_count, nanosec_sum, nanosec_avg, margin_of_error, stats_run_count, samples"
+            " FROM measurements WHERE experiment_id = ? ORDER BY position",
+            (experiment_id,),
+        )
+        measurements = [
+            {
+                "stmt": stmt,
+                "run_count": run_count,
+                "nanosec_sum": nanosec_sum,
+                "nanosec_avg": nanosec_avg,
+                "margin_of_error": margin_of_error,
+                "stats": None if samples is None else {"samples": samples, "run_count": stats_run_count},
+            }
+            for run_count, nanosec_sum, nanosec_avg, margin_of_error, stats_run_count, samples in rows
+        ]
+        return Experiment.from_dict(
+            {"stmt": stmt, "setup": setup, "variance": bool(variance), "measurements": measurements}
+        )
+
+    def baseline(self, stmt: str, setup="pass") -> Optional["Experiment"]:
+        """The most recently saved experiment of this (stmt, setup), if any."""
+        row = self.connection.execute(
+            "SELECT id FROM experiments WHERE stmt_hash = ? ORDER BY created DESC LIMIT 1",
+            (statement_hash(stmt, setup),),
+        ).fetchone()
+        return self.load(row[0]) if row else None
+
+    def entries(self, stmt: str = None, setup="pass") -> list[tuple]:
+        """(id, created, python, runs_counts, nanosec_avgs) of all saved experiments, or only of (stmt, setup)."""
+        query = "SELECT id, created, python, runs_counts, nanosec_avgs FROM experiments"
+        params = ()
+        if stmt is not None:
+            query += " WHERE stmt_hash = ?"
+            params = (statement_hash(stmt, setup),)
+        return self.connection.execute(query + " ORDER BY created", params).fetchall()
+
+
+class BaselineComparison:
+    """Per-run-count verdicts of a fresh experiment against its stored baseline.
+
+    Each side's samples were taken in one burst, so they aren't independent of each other: the thousands of them
+    would make any drift between the two bursts significant. Instead, each side is cut into BASELINE_BLOCKS
+    consecutive stretches, and the Mann-Whitney U test compares the stretches' medians. Even then a change only
+    counts if the two sides' interquartile ranges don't overlap and the median moved by at least
+    BASELINE_MIN_CHANGE; otherwise it's "no change".
+
+    A baseline saved without samples (a plain %measure, without --variance) only has one average, whose own noise is
+    unknown, so there's no verdict: only the change is shown."""
+
+    def __init__(self, baseline: "Experiment", current: "Experiment"):
+        self.baseline = baseline
+        self.current = current
+        self.rows: list[tuple[str, float, float, float, str]] = []
+        for key, measurement in current.measurements.items():
+            if key not in baseline.measurements:
+                continue
+            baseline_measurement = baseline.measurements[key]
+            baseline_ns = self._center(baseline_measurement)
+            current_ns = self._center(measurement)
+            p = self._p_value(baseline_measurement, measurement)
+            if p is None:
+                verdict = "no verdict (no samples)"
+            elif (
+                p >= SIGNIFICANCE_LEVEL
+                or self._overlap(baseline_measurement.stats, measurement.stats)
+                or abs(current_ns - baseline_ns) < BASELINE_MIN_CHANGE * baseline_ns
+            ):
+                verdict = "no change"
+            elif current_ns > baseline_ns:
+                verdict = "REGRESSION"
+            else:
+                verdict = "improvement"
+            self.rows.append((key, baseline_ns, current_ns, p, verdict))
+
+    @staticmethod
+    def _center(measurement: Measurement) -> float:
+        return measurement.stats.median if measurement.stats else measurement.nanosec_avg
+
+    @staticmethod
+    def _block_medians(stats: Stats) -> list[float]:
+        """Per-run medians of BASELINE_BLOCKS consecutive stretches of the samples (in the order they were taken)."""
+        samples = stats.samples
+        blocks = min(BASELINE_BLOCKS, len(samples))
+        return [
+            percentile(sorted(samples[i * len(samples) // blocks : (i + 1) * len(samples) // blocks]), 50)
+            / stats.run_count
+            for i in range(blocks)
+        ]
+
+    @classmethod
+    def _p_value(cls, baseline: Measurement, current: Measurement) -> Optional[float]:
+        if not baseline.stats or not current.stats:
+            return None
+        return mann_whitney_u(cls._block_medians(baseline.stats), cls._block_medians(current.stats))
+
+    @staticmethod
+    def _overlap(baseline: Stats, current: Stats) -> bool:
+        return (
+            baseline.percentiles[25] <= current.percentiles[75] and current.percentiles[25] <= baseline.percentiles[75]
+        )
+
+    @property
+    def regressions(self) -> list[str]:
+        return [key for key, *_, verdict in self.rows if verdict == "REGRESSION"]
+
+    def __bool__(self):
+        """True if any run count regressed."""
+        return bool(self.regressions)
+
+    def __repr__(self) -> str:
+        rows = [("Runs", "Baseline", "Current", "Change", "p-value", "Verdict")]
+        for key, baseline_ns, current_ns, p, verdict in self.rows:
+            change = f"{(current_ns - baseline_ns) * 100 / baseline_ns:+.2f}%"
+            rows.append(
+                (key, human_ns(baseline_ns), human_ns(current_ns), change, "-" if p is None else f"{p:.4f}", verdict)
+            )
+        return format_table(rows, left_columns=(5,))
+
+
+class Comparison:
+    """Interleaved benchmark of several named candidate statements sharing one setup.
+
+    Runs on a Scheduler: every round takes one sample of each candidate, in a freshly shuffled order, so drift
+    (CPU frequency, background load) is spread over all candidates instead of penalizing whichever runs first.
+    Each candidate is auto-ranged to its own run count unless `run_count` is given."""
+
+    def __init__(
+        self,
+        candidates: dict[str, str],
+        setup="pass",
+        run_count: int = None,
+        _globals=None,
+        budget: float = DEFAULT_BUDGET,
+        rel_err: float = DEFAULT_REL_ERR,
+        warmup: int = WARMUP_ROUNDS,
+        disable_gc=True,
+    ):
+        budget_ns = int(budget * 1_000_000_000)
+        deadline = perf_counter_ns() + budget_ns
+        target_ns = max(budget_ns // (AUTORANGE_TARGET_SAMPLES * len(candidates)), 1_000_000)
+        timers = {
+            name: Timer(stmt, setup=scheduled_setup(setup, disable_gc), timer=perf_counter_ns, globals=_globals)
+            for name, stmt in candidates.items()
+        }
+
+        print(f"\nComparing {len(candidates)} candidates within {human_ns(budget_ns, dec=0)}...", end="")
+        run_counts = {}
+        for name, timer in timers.items():
+            if run_count:
+                run_counts[name] = run_count
+            else:
+                run_counts[name], _ = calibrate(timer, target_ns, deadline)
+
+        scheduler = Scheduler(timers, run_counts, warmup=warmup, disable_gc=disable_gc)
+        stats = scheduler.run(deadline=deadline, rel_err=rel_err)
+        print(f" {len(scheduler.drift.factors):,} rounds", end="")
+        self._init_results(candidates, setup, stats, drift=scheduler.drift)
+
+    def _init_results(self, candidates: dict[str, str], setup: str, stats: dict[str, Stats], drift: Drift = None):
+        self.candidates = candidates
+        self.setup = setup
+        self.stats = stats
+        self.drift = drift
+
+    @classmethod
+    def from_stats(
+        cls, candidates: dict[str, str], stats: dict[str, Stats], setup="pass", drift: Drift = None
+    ) -> ForwardRef("Comparison"):
+        """A comparison of samples that were already taken, e.g. loaded from elsewhere or by another process."""
+        comparison = cls.__new__(cls)
+        comparison._init_results(candidates, setup, stats, drift)
+        return comparison
+
+    @property
+    def fastest(self) -> Optional[str]:
+        """The candidate with the lowest median, or None if no round was run."""
+        sampled = [name for name, stats in self.stats.items() if stats]
+        return min(sampled, key=lambda name: self.stats[name].median) if sampled else None
+
+    def p_value(self, name: str, baseline: str = None) -> float:
+        """Mann-Whitney U p-value of `name`'s per-run timings vs. `baseline`'s (the fastest candidate by default)."""
+        baseline = baseline or self.fastest
+        if baseline is None:
+            return 1.0
+        baseline_stats = self.stats[baseline]
+        stats = self.stats[name]
+        return mann_whitney_u(
+            [sample / baseline_stats.run_count for sample in baseline_stats.samples],
+            [sample / stats.run_count for sample in stats.samples],
+        )
+
+    def __getitem__(self, name: str) -> Stats:
+        return self.stats[name]
+
+    def __repr__(self) -> str:
+        fastest = self.fastest
+        rows = [("Candidate", "Median", "IQR", "Relative", "p-value", "Verdict")]
+        for name, stats in sorted(filter(lambda item: item[1], self.stats.items()), key=lambda item: item[1].median):
+            if name == fastest:
+                relative, p_value, verdict = "fastest", "", ""
+            else:
+                p = self.p_value(name)
+                relative = f"{fmt_num(stats.median / self.stats[fastest].median)}× slower"
+                p_value = f"{p:.4f}"
+                verdict = "significant" if p < SIGNIFICANCE_LEVEL else "not significant"
+            iqr = f"{human_ns(stats.percentiles[25])} – {human_ns(stats.percentiles[75])}"
+            rows.append((name, human_ns(stats.median), iqr, relative, p_value, verdict))
+        rows += [(name, "-", "-", "", "", "no samples") for name, stats in self.stats.items() if not stats]
+        table = format_table(rows, left_columns=(0, 5))
+        return table if self.drift is None else f"{table}\n{self.drift}"
+
+
+def subprocess_env(python: str) -> dict[str, str]:
+    """The environment to run `python` in: if it's this interpreter, with PYTHONPATH set to the session's sys.path,
+    so it resolves the same packages the session would."""
+    env = os.environ.copy()
+    if python == sys.executable:
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, sys.path))
+    return env
+
+
+INTERPRETER_MARKER = "-- measure.py: result --"
+INTERPRETER_SCRIPT_HEADER = """\
+from __future__ import annotations
+import json, platform, sys
+from math import inf
+from time import perf_counter_ns
+from timeit import Timer
+"""
+INTERPRETER_SCRIPT_BODY = """\
+args = json.load(sys.stdin)
+timer = Timer(args["stmt"], setup=args["setup"], timer=perf_counter_ns)
+deadline = perf_counter_ns() + args["budget_ns"]
+run_count, nanosec = calibrate(timer, args["target_ns"], deadline)
+samples = [nanosec]
+while perf_counter_ns() < deadline:
+    samples.append(timer.timeit(run_count))
+    margin = relative_margin_of_error(len(samples), sum(samples), sum(sample * sample for sample in samples))
+    if len(samples) >= args["min_samples"] and margin <= args["rel_err"]:
+        break
+result = {
+    "version": f"{platform.python_implementation()} {platform.python_version()}",
+    "run_count": run_count,
+    "samples": samples,
+}
+print(args["marker"] + json.dumps(result))
+"""
+
+
+def interpreter_script() -> str:
+    """A standalone auto-ranging script for another interpreter (3.7+), which may have neither IPython nor this
+    module: it carries its own copies of calibrate and relative_margin_of_error."""
+    helpers = [inspect.getsource(function) for function in (relative_margin_of_error, calibrate)]
+    return "\n\n".join([INTERPRETER_SCRIPT_HEADER, *helpers, INTERPRETER_SCRIPT_BODY])
+
+
+class InterpreterComparison(Comparison):
+    """`stmt` and `setup` auto-ranged under each of several Python interpreters (paths or names on PATH),
+    one subprocess each, sharing `budget` equally. The first interpreter is the baseline for speedups.
+
+    Interpreters that fail are reported and left out."""
+
+    def __init__(
+        self,
+        stmt: str,
+        pythons: list[str],
+        setup="pass",
+        budget: float = DEFAULT_BUDGET,
+        rel_err: float = DEFAULT_REL_ERR,
+    ):
+        stats: dict[str, Stats] = {}
+        self.versions: dict[str, str] = {}
+        budget_ns = int(budget * 1_000_000_000) // len(pythons)
+        payload = json.dumps(
+            {
+                "stmt": stmt,
+                "setup": setup,
+                "budget_ns": budget_ns,
+                "target_ns": max(budget_ns // AUTORANGE_TARGET_SAMPLES, 1_000_000),
+                "rel_err": rel_err,
+                "min_samples": AUTORANGE_MIN_SAMPLES,
+                "marker": INTERPRETER_MARKER,
+            }
+        )
+        script = interpreter_script()
+        print(f"\nComparing {len(pythons)} interpreters, {human_ns(budget_ns, dec=0)} each...", end="")
+        for python in pythons:
+            try:
+                process = subprocess.run(
+                    [python, "-c", script], input=payload, capture_output=True, text=True, env=subprocess_env(python)
+                )
+            except OSError as e:
+                print(f"\n[WARNING][measure.py] Could not run {python}: {e}")
+                continue
+            result_line = next(
+                (line for line in reversed(process.stdout.splitlines()) if line.startswith(INTERPRETER_MARKER)), None
+            )
+            if process.returncode or result_line is None:
+                print(f"\n[WARNING][measure.py] {python} exited with {process.returncode}:\n{process.stderr[-2000:]}")
+                continue
+            result = json.loads(result_line[len(INTERPRETER_MARKER) :])
+            self.versions[python] = result["version"]
+            stats[python] = Stats.from_samples(result["samples"], result["run_count"])
+        if not stats:
+            raise RuntimeError(f"None of {', '.join(pythons)} could run {stmt!r}")
+        self._init_results({python: stmt for python in pythons}, setup, stats)
+        self.baseline = next(iter(stats))
+
+    def __repr__(self) -> str:
+        baseline_median = self.stats[self.baseline].median
+        rows = [("Interpreter", "Version", "Median", "IQR", f"vs. {self.versions[self.baseline]}", "p-value")]
+        for python, stats in self.stats.items():
+            if python == self.baseline:
+                relative, p_value = "baseline", ""
+            else:
+                ratio = baseline_median / stats.median
+                relative = f"{fmt_num(ratio)}× faster" if ratio >= 1 else f"{fmt_num(1 / ratio)}× slower"
+                p_value = f"{self.p_value(python, self.baseline):.4f}"
+            iqr = f"{human_ns(stats.percentiles[25])} – {human_ns(stats.percentiles[75])}"
+            rows.append((python, self.versions[python], human_ns(stats.median), iqr, relative, p_value))
+        return format_table(rows, left_columns=(0, 1))
+
+
+IMPORTTIME_RE = re.compile(r"^import time:\s*(\d+) \|\s*(\d+) \| ( *)(\S.*)$")
+IMPORTTIME_MARKER = "-- measure.py: setup done --"
+
+
+@dataclass
+class ImportNode:
+    name: str
+    self_us: float
+    cumulative_us: float
+    children: list = field(default_factory=list, repr=False)
+
+    def walk(self, depth=0) -> Iterable[tuple[int, ForwardRef("ImportNode")]]:
+        yield depth, self
+        for child in self.children:
+            yield from child.walk(depth + 1)
+
+
+def parse_importtime(output: str) -> list[ImportNode]:
+    """Builds the import tree from `python -X importtime` stderr.
+
+    Each module is printed after the modules it imported, indented two spaces deeper,
+    so children are collected per level until their parent shows up."""
+    pending: dict[int, list[ImportNode]] = {}
+    for line in output.splitlines():
+        if not (match := IMPORTTIME_RE.match(line)):
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        level = len(indent) // 2
+        node = ImportNode(name, int(self_us), int(cumulative_us), pending.pop(level + 1, []))
+        pending.setdefault(level, []).append(node)
+    return pending.get(0, [])
+
+
+class ImportProfile:
+    """Cold-import cost of `stmt`, timed in `repeat` fresh interpreters with `python -X importtime`.
+
+    Only imports triggered by `stmt` count: `setup` and interpreter startup run before a marker line.
+    Self and cumulative times are the per-module medians across runs; the tree shape comes from the first run."""
+
+    def __init__(self, stmt: str, setup="pass", python: str = sys.executable, repeat: int = 5):
+        self.stmt = stmt
+        self.setup = setup
+        self.python = python
+        code = f"{setup}\nimport sys\nprint({IMPORTTIME_MARKER!r}, file=sys.stderr, flush=True)\n{stmt}"
+        env = subprocess_env(python)
+        print(f"\nTiming cold import in {repeat} fresh interpreter(s)...", end="")
+        runs: list[list[ImportNode]] = []
+        for _ in range(repeat):
+            process = subprocess.run([python, "-X", "importtime", "-c", code], capture_output=True, text=True, env=env)
+            if process.returncode:
+                raise RuntimeError(f"{python} exited with {process.returncode}:\n{process.stderr[-2000:]}")
+            runs.append(parse_importtime(process.stderr.partition(IMPORTTIME_MARKER)[2]))
+
+        timings: dict[str, tuple[list[int], list[int]]] = {}
+        for roots in runs:
+            for root in roots:
+                for _, node in root.walk():
+                    self_times, cumulative_times = timings.setdefault(node.name, ([], []))
+                    self_times.append(node.self_us)
+                    cumulative_times.append(node.cumulative_us)
+        self.roots = runs[0]
+        for root in self.roots:
+            for _, node in root.walk():
+                self_times, cumulative_times = timings[node.name]
+                node.self_us = percentile(sorted(self_times), 50)
+                node.cumulative_us = percentile(sorted(cumulative_times), 50)
+        self.total_us = sum(root.cumulative_us for root in self.roots)
+
+    @property
+    def nodes(self) -> list[ImportNode]:
+        return [node for root in self.roots for _, node in root.walk()]
+
+    def top(self, n=15, by="self") -> list[ImportNode]:
+        """The `n` modules with the largest self (or cumulative) import time."""
+        return sorted(self.nodes, key=lambda node: getattr(node, f"{by}_us"), reverse=True)[:n]
+
+    def tree(self, min_percent=1.0) -> str:
+        """Indented import tree, hiding subtrees under `min_percent` of the total."""
+        lines = []
+        for root in self.roots:
+            for depth, node in root.walk():
+                percent = node.cumulative_us * 100 / self.total_us if self.total_us else 0
+                if percent < min_percent:
+                    continue
+                lines.append(
+                    f"{human_ns(node.cumulative_us * 1000).rjust(10)} {HDIV} {fmt_num(percent).rjust(6)}% {HDIV} "
+                    f"{'  ' * depth}{node.name}"
+                )
+        return "\n".join(lines)
+
+    def __repr__(self) -> str:
+        rows = [("Module", "Self", "Cumulative", "% of total")]
+        for node in self.top():
+            percent = node.self_us * 100 / self.total_us if self.total_us else 0
+            rows.append(
+                (node.name, human_ns(node.self_us * 1000), human_ns(node.cumulative_us * 1000), f"{fmt_num(percent)}%")
+            )
+        return f"Total: {human_ns(self.total_us * 1000)}\n\n{format_table(rows)}\n\n{self.tree()}"
+
+
+CELL_HEADER_RE = re.compile(r"^##\s*(.+?)\s*$")
+
+
+def parse_cell(cell: str) -> tuple[dict[str, str], str]:
+    """Splits a %%measure cell into candidates and shared setup.
+
+    Blocks start with a '## name' line; a block named 'setup' is shared setup. Without any headers,
+    every non-empty line is a candidate named after itself."""
+    blocks: dict[str, list[str]] = {}
+    name = None
+    for line in cell.splitlines():
+        if match := CELL_HEADER_RE.match(line):
+            name = match.group(1)
+            blocks[name] = []
+        elif name is not None:
+            blocks[name].append(line)
+    if not blocks:
+        candidates = {line.strip(): line.strip() for line in cell.splitlines() if line.strip()}
+        return candidates, "pass"
+    setup = textwrap.dedent("\n".join(blocks.pop("setup", []))).strip() or "pass"
+    candidates = {name: textwrap.dedent("\n".join(lines)).strip() for name, lines in blocks.items()}
+    return candidates, setup
+
+
+FLAGS = {
+    "--variance": "variance",
+    "--auto": "autorange",
+    "--isolate": "isolate",
+    "--pin": "pin",
+    "--compare": "compare",
+    "--memory": "memory",
+    "--cold": "cold",
+    "--async": "async",
+    "--profile": "profile",
+    "--background": "background",
+    "--interleave": "interleave",
+    "--gc": "gc",
+}
+OPTIONS = {
+    "-n": "runs_counts",
+    "-p": "param",
+    "-s": "setup",
+    "--budget": "budget",
+    "--rel-err": "rel_err",
+    "--workers": "workers",
+    "--scale": "scale",
+    "--rounds": "rounds",
+    "--warmup": "warmup",
+    "--pythons": "pythons",
+}
+OPTION_RE = re.compile(
+    r"(?<!\S)(%s)(?=\s|$)|(?<!\S)(-n)(?=\d)"
+    % "|".join(map(re.escape, sorted([*FLAGS, *OPTIONS], key=len, reverse=True)))
+)
+
+
+def parse_args(line: str) -> dict:
+    """Parses:
+    STMT (everything that isn't an option)
+    -n RUNS_COUNTS (comma separated, e.g. -n 5,10 or -n5,10)
+    -s SETUP (everything up to the next option)
+    -p NAME=SIZES (comma separated, e.g. -p n=10,100,1000; sweeps NAME over SIZES, see Sweep)
+    --variance
+    --auto [--budget SECONDS] [--rel-err FRACTION]
+    --isolate [--workers N] [--pin]
+    --memory
+    --interleave [--rounds N] [--warmup N] [--gc] (sample all run counts together in shuffled rounds; see Scheduler)
+    --background (return a BackgroundExperiment right away; see BackgroundExperiment)
+    --profile (attach a ranked hotspot table from one extra, profiled pass; see Hotspots)
+    --scale WORKER_COUNTS (comma separated, e.g. --scale 1,2,4,8; see Scaling)
+    --async (await `stmt` on a reused event loop, with the session's namespace; see AsyncMeasurement)
+    --pythons PYTHONS (comma separated interpreter paths or names; see InterpreterComparison)
+    --cold (time the imports `stmt` triggers in fresh interpreters; see ImportProfile)
+    --compare (rerun against the last saved experiment of the same stmt and setup instead of saving a new one)
+    --gc keeps the garbage collector on while timing (timeit turns it off); applies to --interleave and %%measure.
+    """
+    args = {
+        "stmt": "",
+        "setup": "pass",
+        "runs_counts": DEFAULT_RUNS_COUNTS,
+        "budget": DEFAULT_BUDGET,
+        "rel_err": DEFAULT_REL_ERR,
+        "workers": 1,
+        "rounds": INTERLEAVE_ROUNDS,
+        "warmup": WARMUP_ROUNDS,
+        "param": None,
+        "scale": None,
+        "pythons": None,
+        **{name: False for name in FLAGS.values()},
+    }
+    matches = list(OPTION_RE.finditer(line))
+    stmt = [line[: matches[0].start()] if matches else line]
+    for match, next_match in zip(matches, [*matches[1:], None]):
+        option = match.group(1) or match.group(2)
+        value = line[match.end() : next_match.start() if next_match else len(line)].strip()
+        if option in FLAGS:
+            args[FLAGS[option]] = True
+            stmt.append(value)
+            continue
+        name = OPTIONS[option]
+        if name == "setup":
+            args["setup"] = value or "pass"
+            continue
+        value, _, rest = value.partition(" ")
+        stmt.append(rest)
+        if name == "runs_counts":
+            args["runs_counts"] = [int(number) for number in value.split(",")]
+        elif name in ("workers", "rounds", "warmup"):
+            args[name] = int(value)
+        elif name == "pythons":
+            args["pythons"] = value.split(",")
+        elif name == "scale":
+            args["scale"] = [int(count) for count in value.split(",")]
+        elif name == "param":
+            param_name, _, sizes = value.partition("=")
+            args["param"] = (param_name, [int(size) for size in sizes.split(",")])
+        else:
+            args[name] = float(value)
+    args["stmt"] = " ".join(filter(None, map(str.strip, stmt)))
+    return args
 
 
 from pdbpp import break_on_exc
@@ -239,58 +2678,82 @@ from pdbpp import break_on_exc
 
 def load_ipython_extension(ipython):
     print("Loaded extension measure")
+    ipython.events.register("post_run_cell", forget_finished_experiments)
 
     @register_line_cell_magic("measure")
     @break_on_exc
     def linemagic(line: str, cell: str = None):
         if not line and not cell:
             return
+        args = parse_args(line)
+        args["disable_gc"] = not args.pop("gc")
         if cell:
-            print("Not implemented yet! cell: ", cell)
-            return
-        stmt = []
-        variance = False
-        setup = "pass"
-        runs_counts = (*range(1, 11), 100, 1000, 10_000, 100_000)
-        i = -1
-        while i + 1 < len(line):
-            i += 1
-            char = line[i]
-            if char != "-":
-                stmt.append(char)
-                continue
-
-            if line[i : i + 10] == "--variance":
-                variance = True
-                i = i + 9
-                continue
-
-            if line[i + 2] != " ":
-                arg_value_start_idx = i + 2
-            else:
-                arg_value_start_idx = i + 3
-
-            # ** Number of runs
-            if line[i + 1] == "n":
-                if match := re.search(r"[ -]", line[arg_value_start_idx:]):
-                    arg_value_stop_idx = match.span()[0] + arg_value_start_idx
-                    runs_counts = [int(number) for number in line[arg_value_start_idx:arg_value_stop_idx].split(",")]
-                    i = arg_value_stop_idx - 1
-                    continue
-                runs_counts = [int(number) for number in line[arg_value_start_idx:].split(",")]
-                break
-
-            # ** Setup
-            if line[i + 1] == "s":
-                arg_value_stop_idx = line[arg_value_start_idx:].rfind("-")  # -1 if not found
-                if arg_value_stop_idx != -1:
-                    arg_value_stop_idx += arg_value_start_idx
-                    setup = line[arg_value_start_idx:arg_value_stop_idx]
-                    i = arg_value_stop_idx - 1
-                    continue
-                setup = line[arg_value_start_idx:].strip()
-                break
-
-        measures = Experiment(stmt="".join(stmt), runs_counts=runs_counts, setup=setup, variance=variance)
+            candidates, cell_setup = parse_cell(cell)
+            setup = "\n".join(filter(lambda code: code != "pass", (args["setup"], cell_setup))) or "pass"
+            run_count = None if args["runs_counts"] is DEFAULT_RUNS_COUNTS else args["runs_counts"][0]
+            comparison = Comparison(
+                candidates,
+                setup=setup,
+                run_count=run_count,
+                _globals=ipython.user_ns,
+                budget=args["budget"],
+                rel_err=args["rel_err"],
+                warmup=args["warmup"],
+                disable_gc=args["disable_gc"],
+            )
+            print("\n" + str(comparison))
+            return comparison
+        if args.pop("async"):
+            run_count = None if args["runs_counts"] is DEFAULT_RUNS_COUNTS else args["runs_counts"][0]
+            measurement = AsyncMeasurement(
+                args["stmt"], setup=args["setup"], run_count=run_count, _globals=ipython.user_ns, budget=args["budget"]
+            )
+            print("\n" + str(measurement))
+            return measurement
+        if args.pop("cold"):
+            profile = ImportProfile(args["stmt"], setup=args["setup"])
+            print("\n" + str(profile))
+            return profile
+        pythons = args.pop("pythons")
+        if pythons:
+            comparison = InterpreterComparison(
+                args["stmt"], pythons, setup=args["setup"], budget=args["budget"], rel_err=args["rel_err"]
+            )
+            print("\n" + str(comparison))
+            return comparison
+        scale = args.pop("scale")
+        if scale:
+            scaling = Scaling(args["stmt"], workers=scale, setup=args["setup"], budget=args["budget"])
+            print("\n" + str(scaling))
+            return scaling
+        param = args.pop("param")
+        if param:
+            sweep = Sweep(args["stmt"], param, setup=args["setup"], budget=args["budget"], rel_err=args["rel_err"])
+            print("\n" + str(sweep))
+            return sweep
+        if args.pop("background"):
+            for option in ("isolate", "workers", "pin", "compare", "interleave", "rounds", "warmup", "disable_gc"):
+                args.pop(option, None)
+            return BackgroundExperiment(**args)
+        compare = args.pop("compare")
+        with History() as history:
+            if compare:
+                baseline = history.baseline(args["stmt"], args["setup"])
+                if baseline is None:
+                    print(f"No saved baseline for {args['stmt']!r}; measuring and saving one instead.")
+                else:
+                    # Measured the way the baseline was: a single pass each, or repetitions to sample from.
+                    args.update(runs_counts=baseline.runs_counts, variance=baseline.variance, autorange=False)
+                    if not baseline.variance:
+                        print(
+                            f"The baseline of {args['stmt']!r} has no samples, so there will be no verdict; "
+                            "save one with --variance to get one."
+                        )
+                    current = Experiment(**args)
+                    comparison = BaselineComparison(baseline, current)
+                    print("\n" + str(comparison))
+                    return comparison
+            measures = Experiment(**args)
+            history.save(measures)
         print("\n" + str(measures))
         return measures
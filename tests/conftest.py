@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The extensions are loaded by IPython from the profile, not installed; import them as `extensions.<name>`.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
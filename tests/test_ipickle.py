@@ -0,0 +1,454 @@
+import json
+import mmap
+import pickle
+import threading
+from types import SimpleNamespace
+
+import pytest
+from IPython.core.inputtransformer2 import TransformerManager
+from IPython.testing import globalipapp
+
+from extensions import ipickle
+from extensions.ipickle import (
+    BackgroundSave,
+    CODECS,
+    COMPRESSED_MAGIC,
+    OUT_OF_BAND_MIN_BYTES,
+    SIZES_DEPTH,
+    SIZES_FANOUT,
+    SizeProfiler,
+    cache_dir,
+    cached_run,
+    cell_names,
+    dump_to_file,
+    is_compressed_pickle_file,
+    is_pickle_file,
+    list_session,
+    load_from_file,
+    manifest_path,
+    map_sidecar,
+    object_path,
+    process_expression,
+    process_sizes,
+    restore_session,
+    save_session,
+    sessions_dir,
+    sidecar_path,
+    write_sidecar,
+)
+
+loaded = []
+
+
+@pytest.fixture
+def ipython_dir(tmp_path, monkeypatch):
+    """An empty IPython directory, where the session store and the %%cache cache go."""
+    monkeypatch.setenv("IPYTHONDIR", str(tmp_path / "ipython"))
+    return tmp_path / "ipython"
+
+
+def session_definition(source: str):
+    """A function or class as if defined in an IPython cell."""
+    namespace = {"__name__": "__main__"}
+    exec(source, namespace)
+    return namespace[source.split()[1].split("(")[0].rstrip(":")]
+
+
+def record_load(value):
+    loaded.append(value)
+    return value
+
+
+class LoadRecorder:
+    def __reduce__(self):
+        return record_load, ("loaded",)
+
+
+class TestIsPickleFile:
+    @pytest.mark.parametrize("protocol", range(pickle.HIGHEST_PROTOCOL + 1))
+    def test_every_protocol(self, tmp_path, protocol):
+        path = tmp_path / "obj.pkl"
+        path.write_bytes(pickle.dumps({"a": [1, 2.5, "three"]}, protocol=protocol))
+        assert is_pickle_file(path)
+
+    @pytest.mark.parametrize(
+        "data",
+        [
+            b"",
+            b".",
+            b"Just some text.",  # Ends with STOP, but doesn't parse
+            b"\x80\x63whatever.",  # PROTO with an unknown protocol
+            pickle.dumps([1, 2, 3], protocol=4)[:-1],  # Truncated
+        ],
+    )
+    def test_not_pickles(self, tmp_path, data):
+        path = tmp_path / "data"
+        path.write_bytes(data)
+        assert not is_pickle_file(path)
+
+    def test_missing_file_and_directory(self, tmp_path):
+        assert not is_pickle_file(tmp_path / "missing.pkl")
+        assert not is_pickle_file(tmp_path)
+
+    @pytest.mark.parametrize("protocol", [0, pickle.HIGHEST_PROTOCOL])
+    def test_does_not_load(self, tmp_path, protocol):
+        path = tmp_path / "obj.pkl"
+        path.write_bytes(pickle.dumps(LoadRecorder(), protocol=protocol))
+        assert is_pickle_file(path)
+        assert loaded == []
+
+
+class TestSidecar:
+    big = bytes(range(256)) * (OUT_OF_BAND_MIN_BYTES // 256 + 1)
+
+    def test_large_buffers_go_out_of_band(self, tmp_path):
+        path = tmp_path / "obj.pkl"
+        dump_to_file({"big": pickle.PickleBuffer(bytearray(self.big)), "small": pickle.PickleBuffer(b"small")}, path)
+        assert sidecar_path(path).exists()
+        assert path.stat().st_size < 1024
+        loaded = load_from_file(path)
+        assert isinstance(loaded["big"], mmap.mmap)  # Mapped, not copied into the stream
+        assert loaded["big"][:] == self.big
+        assert bytes(loaded["small"]) == b"small"
+
+    def test_writes_to_loaded_buffers_stay_in_memory(self, tmp_path):
+        path = tmp_path / "obj.pkl"
+        dump_to_file(pickle.PickleBuffer(bytearray(self.big)), path)
+        loaded = load_from_file(path)
+        loaded[:4] = b"XXXX"
+        assert load_from_file(path)[:4] == self.big[:4]
+
+    def test_no_sidecar_without_large_buffers(self, tmp_path):
+        path = tmp_path / "obj.pkl"
+        dump_to_file(pickle.PickleBuffer(bytearray(self.big)), path)
+        dump_to_file([1, 2, 3], path)
+        assert not sidecar_path(path).exists()  # The previous dump's is removed
+        assert load_from_file(path) == [1, 2, 3]
+
+    def test_each_buffer_mapped_on_its_own(self, tmp_path):
+        sidecar = tmp_path / "obj.pkl.buffers"
+        buffers = [b"first", b"", b"second" * 1000]
+        write_sidecar(sidecar, [memoryview(buffer) for buffer in buffers], b"d" * 32)
+        mapped = map_sidecar(sidecar, b"d" * 32)
+        assert [bytes(buffer) for buffer in mapped] == buffers
+        assert [memoryview(buffer).obj is buffer for buffer in mapped] == [True, True, True]
+
+    def test_not_a_sidecar(self, tmp_path):
+        sidecar = tmp_path / "obj.pkl.buffers"
+        sidecar.write_bytes(b"something else entirely")
+        with pytest.raises(ValueError, match="not an ipickle buffers file"):
+            map_sidecar(sidecar, b"d" * 32)
+
+    def test_numpy_round_trip(self, tmp_path):
+        numpy = pytest.importorskip("numpy")
+        array = numpy.arange(OUT_OF_BAND_MIN_BYTES // 8 * 2, dtype=numpy.float64).reshape(-1, 4)
+        path = tmp_path / "array.pkl"
+        dump_to_file(array, path)
+        assert sidecar_path(path).exists()
+        loaded = load_from_file(path)
+        assert numpy.array_equal(loaded, array)
+
+
+class TestCompressed:
+    obj = {"numbers": list(range(100_000)), "text": "abc" * 100_000, "blob": bytes(range(256)) * 10_000}
+
+    @pytest.mark.parametrize("codec", sorted(CODECS))
+    def test_round_trip(self, tmp_path, codec):
+        path = tmp_path / "obj.pkl"
+        dump_to_file(self.obj, path, codec=codec)
+        assert is_compressed_pickle_file(path)
+        assert is_pickle_file(path)
+        assert path.stat().st_size < len(pickle.dumps(self.obj)) / 2
+        assert load_from_file(path) == self.obj
+
+    def test_many_chunks(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(ipickle, "CHUNK_SIZE", 4096)
+        path = tmp_path / "obj.pkl"
+        dump_to_file(self.obj, path, codec="gzip")
+        assert load_from_file(path) == self.obj
+
+    def test_replaces_an_uncompressed_dump(self, tmp_path):
+        path = tmp_path / "obj.pkl"
+        dump_to_file(pickle.PickleBuffer(bytearray(OUT_OF_BAND_MIN_BYTES)), path)
+        dump_to_file(self.obj, path, codec="lzma")
+        assert not sidecar_path(path).exists()
+        assert load_from_file(path) == self.obj
+
+    def test_unavailable_codec(self, tmp_path):
+        path = tmp_path / "obj.pkl"
+        path.write_bytes(COMPRESSED_MAGIC + bytes([6]) + b"brotli")
+        with pytest.raises(ValueError, match="brotli, which is not available"):
+            load_from_file(path)
+
+
+class TestFileOnlyOptions:
+    @staticmethod
+    def ipython() -> SimpleNamespace:
+        return SimpleNamespace(user_ns={"x": [1, 2, 3]})
+
+    @pytest.mark.parametrize("options", [dict(codec="gzip"), dict(background=True)])
+    def test_without_a_file_output(self, options):
+        with pytest.raises(ValueError, match="only apply to a file output"):
+            process_expression("x", **options, ipython=self.ipython())
+
+    @pytest.mark.parametrize("options", [dict(codec="gzip"), dict(background=True)])
+    def test_output_in_a_missing_directory(self, tmp_path, options):
+        with pytest.raises(ValueError, match="only apply to a file output"):
+            process_expression("x", str(tmp_path / "missing" / "x.pkl"), **options, ipython=self.ipython())
+
+    def test_when_loading(self, tmp_path):
+        path = tmp_path / "obj.pkl"
+        path.write_bytes(pickle.dumps([1]))
+        with pytest.raises(ValueError, match="only apply when pickling"):
+            process_expression(str(path), str(tmp_path / "out.pkl"), codec="gzip", ipython=self.ipython())
+
+    def test_with_a_file_output(self, tmp_path):
+        path = tmp_path / "x.pkl"
+        process_expression("x", str(path), codec="gzip", ipython=self.ipython())
+        assert is_compressed_pickle_file(path)
+        assert load_from_file(path) == [1, 2, 3]
+
+
+def fake_shell(**user_ns) -> SimpleNamespace:
+    return SimpleNamespace(user_ns=user_ns, user_ns_hidden={})
+
+
+def stored_objects() -> list:
+    return sorted(path.name for path in sessions_dir().glob("objects/*/*"))
+
+
+class TestSession:
+    def test_round_trip(self, ipython_dir):
+        save_session(ipython=fake_shell(data=[1, 2, 3], config={"a": 1}, _private=1, module=json))
+        assert set(list_session()) == {"data", "config"}
+        shell = fake_shell()
+        restore_session(ipython=shell)
+        assert shell.user_ns == {"data": [1, 2, 3], "config": {"a": 1}}
+
+    def test_restore_some(self, ipython_dir):
+        save_session("s", ipython=fake_shell(data=[1, 2, 3], config={"a": 1}))
+        shell = fake_shell()
+        restore_session("s", ["config"], ipython=shell)
+        assert shell.user_ns == {"config": {"a": 1}}
+        with pytest.raises(KeyError, match="missing"):
+            restore_session("s", ["missing"], ipython=shell)
+        with pytest.raises(FileNotFoundError, match="no saved session 'other'"):
+            restore_session("other", ipython=shell)
+
+    def test_first_save_with_nothing_to_write(self, ipython_dir, capsys):
+        save_session(ipython=fake_shell(module=json, helper=session_definition("def helper(): pass")))
+        assert json.loads(manifest_path("default").read_text()) == {}
+        assert "helper (defined in the session)" in capsys.readouterr().out
+
+    def test_unpicklable_variables_are_skipped(self, ipython_dir, capsys):
+        save_session(ipython=fake_shell(data=[1], lock=threading.Lock()))
+        assert set(list_session()) == {"data"}
+        assert "Skipped: lock (TypeError)" in capsys.readouterr().out
+
+    def test_unchanged_variables_are_not_rewritten(self, ipython_dir, capsys):
+        shell = fake_shell(data=list(range(1000)), config={"a": 1})
+        save_session(ipython=shell)
+        path = object_path(list_session()["data"]["digest"])
+        mtime = path.stat().st_mtime_ns
+        shell.user_ns["config"]["a"] = 2
+        capsys.readouterr()
+        save_session(ipython=shell)
+        assert "1 changed" in capsys.readouterr().out
+        assert path.stat().st_mtime_ns == mtime
+
+    def test_prunes_unreferenced_objects(self, ipython_dir):
+        shell = fake_shell(data=[1], config={"a": 1})
+        save_session("first", ipython=shell)
+        save_session("second", ipython=fake_shell(data=[1]))
+        shell.user_ns["config"] = {"a": 2}
+        save_session("first", ipython=shell)
+        referenced = {entry["digest"] for session in ("first", "second") for entry in list_session(session).values()}
+        assert stored_objects() == sorted(referenced)
+        assert len(referenced) == 2  # `data` is shared, the old `config` is gone
+
+    def test_no_leftover_manifest_temp_file(self, ipython_dir):
+        save_session(ipython=fake_shell(data=[1]))
+        assert sorted(path.name for path in sessions_dir().iterdir()) == ["default.json", "objects"]
+
+    def test_restore_goes_on_after_a_failure(self, ipython_dir, capsys):
+        save_session(ipython=fake_shell(broken=[1], fine=[2]))
+        object_path(list_session()["broken"]["digest"]).write_bytes(b"garbage")
+        shell = fake_shell()
+        restore_session(ipython=shell)
+        assert shell.user_ns == {"fine": [2]}
+        assert "[WARNING][ipickle.py] Could not restore: broken" in capsys.readouterr().out
+
+
+class TestBackgroundSave:
+    big = bytearray(b"x" * OUT_OF_BAND_MIN_BYTES)
+
+    def test_saves_a_snapshot(self, tmp_path):
+        path = tmp_path / "obj.pkl"
+        obj = {"data": list(range(1000)), "blob": pickle.PickleBuffer(self.big)}
+        save = BackgroundSave(obj, str(path))
+        obj["data"].append("changed after the fork")
+        assert save.wait(timeout=30).done
+        assert save.error is None
+        assert save.size == path.stat().st_size + sidecar_path(path).stat().st_size
+        loaded = load_from_file(path)
+        assert loaded["data"] == list(range(1000))
+        assert loaded["blob"][:] == self.big
+        assert sorted(path.name for path in tmp_path.iterdir()) == ["obj.pkl", "obj.pkl.buffers"]
+
+    def test_reports_errors(self, tmp_path):
+        save = BackgroundSave(threading.Lock(), str(tmp_path / "lock.pkl")).wait(timeout=30)
+        assert "TypeError" in save.error
+        assert list(tmp_path.iterdir()) == []
+
+    def test_sidecar_of_another_save_is_detected(self, tmp_path):
+        old, new = tmp_path / "old.pkl", tmp_path / "new.pkl"
+        dump_to_file({"blob": pickle.PickleBuffer(self.big), "version": 1}, old)
+        dump_to_file({"blob": pickle.PickleBuffer(bytearray(b"y" * len(self.big))), "version": 2}, new)
+        # What a load sees between the two renames of a background save: the new sidecar, the old pickle.
+        sidecar_path(new).replace(sidecar_path(old))
+        with pytest.raises(ValueError, match="belongs to another version"):
+            load_from_file(old)
+
+
+@pytest.mark.parametrize(
+    "cell, read, assigned",
+    [
+        ("y = x * 2", {"x"}, {"y"}),
+        ("x = x + 1", {"x"}, {"x"}),
+        ("x += 1", {"x"}, {"x"}),
+        ("x = 1\ny = x", set(), {"x", "y"}),
+        ("cfg[key] = value", {"cfg", "key", "value"}, set()),
+        ("obj.attr = 1", {"obj"}, set()),
+        ("a, b = pair", {"pair"}, {"a", "b"}),
+        ("import numpy as np\nimport os.path\narr = zeros(n)", {"zeros", "n"}, {"np", "os", "arr"}),
+        ("def f():\n    return g()\n\nclass C:\n    pass", {"g"}, {"f", "C"}),
+        # IPython syntax, once transformed, reads get_ipython
+        ("x = 1\n%time y = x", {"get_ipython"}, {"x"}),
+        ("!ls\nz = 1", {"get_ipython"}, {"z"}),
+        ("df?", {"get_ipython"}, set()),
+    ],
+)
+def test_cell_names(cell, read, assigned):
+    assert cell_names(TransformerManager().transform_cell(cell)) == (read, assigned)
+
+
+@pytest.fixture
+def shell(ipython_dir):
+    shell = globalipapp.get_ipython()
+    shell.reset()
+    yield shell
+    shell.reset()
+
+
+class TestCachedRun:
+    def test_miss_then_hit(self, shell, capsys):
+        shell.user_ns["x"] = [1, 2]
+        cached_run("y = x * 2\nprint('ran')", ipython=shell)
+        assert shell.user_ns["y"] == [1, 2, 1, 2]
+        assert "ran" in capsys.readouterr().out
+        del shell.user_ns["y"]
+        cached_run("y = x * 2\nprint('ran')", ipython=shell)
+        assert shell.user_ns["y"] == [1, 2, 1, 2]
+        output = capsys.readouterr().out
+        assert "ran" not in output
+        assert "Restored y from cache" in output
+        assert len(list(cache_dir().glob("*.pkl"))) == 1
+
+    def test_changed_input_misses(self, shell):
+        shell.user_ns["x"] = [1]
+        cached_run("y = x * 2", ipython=shell)
+        shell.user_ns["x"] = [2]
+        cached_run("y = x * 2", ipython=shell)
+        assert shell.user_ns["y"] == [2, 2]
+
+    def test_force_reruns(self, shell, capsys):
+        cached_run("print('ran')", ipython=shell)
+        cached_run("print('ran')", force=True, ipython=shell)
+        assert capsys.readouterr().out.count("ran") == 2
+
+    def test_inputs_mutated_in_place_are_stored(self, shell):
+        shell.user_ns["cfg"] = {}
+        cached_run("cfg['seen'] = True", ipython=shell)
+        shell.user_ns["cfg"] = {}
+        cached_run("cfg['seen'] = True", ipython=shell)  # A hit: restores cfg as the cell left it
+        assert shell.user_ns["cfg"] == {"seen": True}
+
+    def test_changed_session_helper_misses(self, shell):
+        shell.run_cell("def step(value):\n    return value + 1")
+        cached_run("y = step(1)", ipython=shell)
+        shell.run_cell("def step(value):\n    return value + 2")
+        cached_run("y = step(1)", ipython=shell)
+        assert shell.user_ns["y"] == 3
+
+    def test_modules_are_reimported(self, shell):
+        cached_run("import json\nn = 1", ipython=shell)
+        del shell.user_ns["json"]
+        cached_run("import json\nn = 1", ipython=shell)
+        assert shell.user_ns["json"] is json
+
+    def test_session_definitions_are_not_cached(self, shell, capsys):
+        cached_run("def f():\n    pass", ipython=shell)
+        assert "Not caching: f defined in the cell" in capsys.readouterr().out
+        assert not cache_dir().exists() or not list(cache_dir().glob("*.pkl"))
+
+    @pytest.mark.parametrize("cell", ["x = 1\n%time y = x", "!true\nz = 1", "x = 1\nx?"])
+    def test_ipython_syntax_runs_uncached(self, shell, capsys, cell):
+        cached_run(cell, ipython=shell)
+        assert "Not caching: the cell uses magics" in capsys.readouterr().out
+        assert shell.user_ns.get("y", 1) == 1 and shell.user_ns.get("z", 1) == 1
+
+    def test_syntax_error_runs_uncached(self, shell, capsys):
+        cached_run("x = (", ipython=shell)
+        assert "Not caching: the cell doesn't parse" in capsys.readouterr().out
+
+
+class Config:
+    def __init__(self):
+        self.name = "cfg"
+        self.data = list(range(1000))
+        self.lookup = {"big": "x" * 5000, 3: "small"}
+        self.pair = ("a" * 100, b"b" * 200)
+
+
+class TestSizeProfiler:
+    def test_totals(self):
+        profiler = SizeProfiler("cfg").measure(Config())
+        assert profiler.total == len(pickle.dumps(Config(), protocol=pickle.HIGHEST_PROTOCOL))
+        # Types are exclusive, so they add up to the root's size: everything but the stream's header and STOP.
+        assert sum(profiler.by_type.values()) == profiler.by_path["cfg"]
+        assert profiler.total - profiler.by_path["cfg"] < 16
+
+    def test_paths(self):
+        by_path = SizeProfiler("cfg").measure(Config()).by_path
+        assert by_path["cfg.lookup['big']"] > 5000
+        assert by_path["cfg.lookup"] > by_path["cfg.lookup['big']"] + by_path["cfg.lookup[3]"]
+        assert by_path["cfg.pair[0]"] > 100 and by_path["cfg.pair[1]"] > 200
+        assert by_path["cfg.name"] < 10
+        assert {"cfg.data[0]", f"cfg.data[{SIZES_FANOUT - 1}]", "cfg.data[...]"} <= set(by_path)
+        assert f"cfg.data[{SIZES_FANOUT}]" not in by_path
+
+    def test_types(self):
+        by_type = SizeProfiler("cfg").measure(Config()).by_type
+        assert by_type["str"] > 5100
+        assert by_type["bytes"] > 200
+        assert by_type["int"] > 2000
+        assert f"{__name__}.Config" in by_type
+
+    def test_depth(self):
+        nested = {"a": {"b": {"c": {"d": {"e": {"f": "deep"}}}}}}
+        by_path = SizeProfiler("nested").measure(nested).by_path
+        assert max(path.count("[") for path in by_path) == SIZES_DEPTH
+
+    def test_failed_path(self):
+        config = Config()
+        config.lookup["lock"] = threading.Lock()
+        profiler = SizeProfiler("cfg")
+        with pytest.raises(TypeError):
+            profiler.measure(config)
+        assert profiler.failed_path == "cfg.lookup['lock']"
+
+    def test_magic_names_the_failing_path(self):
+        config = Config()
+        config.pair = (threading.Lock(),)
+        with pytest.raises(pickle.PicklingError, match=r"at config\.pair\[0\]: TypeError"):
+            process_sizes(["config"], ipython=fake_shell(config=config))
@@ -0,0 +1,490 @@
+import json
+import random
+import statistics
+from array import array
+from collections import Counter
+from math import inf, log2
+
+import pytest
+
+from extensions.measure import (
+    BaselineComparison,
+    Drift,
+    Experiment,
+    History,
+    Hotspots,
+    DEFAULT_BUDGET,
+    DEFAULT_RUNS_COUNTS,
+    Measurement,
+    Scheduler,
+    ResourceUsage,
+    Stats,
+    Sweep,
+    calibrate,
+    fit_complexity,
+    folded_stacks,
+    mann_whitney_u,
+    parse_args,
+    parse_cell,
+    parse_importtime,
+    percentile,
+    relative_margin_of_error,
+    speedscope_profile,
+)
+
+
+class TestParseArgs:
+    def test_stmt_only(self):
+        args = parse_args("sorted(data)")
+        assert args["stmt"] == "sorted(data)"
+        assert args["setup"] == "pass"
+        assert args["runs_counts"] == DEFAULT_RUNS_COUNTS
+        assert args["budget"] == DEFAULT_BUDGET
+        assert not args["variance"]
+
+    def test_setup_runs_up_to_next_option(self):
+        args = parse_args("sorted(data) -s data = list(range(10)) --variance")
+        assert args["stmt"] == "sorted(data)"
+        assert args["setup"] == "data = list(range(10))"
+        assert args["variance"]
+
+    @pytest.mark.parametrize("line", ["x + 1 -n 5,10", "x + 1 -n5,10", "-n 5,10 x + 1"])
+    def test_runs_counts(self, line):
+        args = parse_args(line)
+        assert args["runs_counts"] == [5, 10]
+        assert args["stmt"] == "x + 1"
+
+    def test_typed_options(self):
+        args = parse_args(
+            "f(n) -p n=10,100 --budget 2.5 --rel-err 0.01 --workers 4 --scale 1,2 --pythons python3.11,pypy3"
+        )
+        assert args["stmt"] == "f(n)"
+        assert args["param"] == ("n", [10, 100])
+        assert args["budget"] == 2.5
+        assert args["rel_err"] == 0.01
+        assert args["workers"] == 4
+        assert args["scale"] == [1, 2]
+        assert args["pythons"] == ["python3.11", "pypy3"]
+
+    def test_option_inside_a_name_is_stmt(self):
+        args = parse_args("x--memory")
+        assert args["stmt"] == "x--memory"
+        assert not args["memory"]
+
+
+class FakeTimer:
+    """Takes `ns_per_run` per run, and records the run counts it was asked for."""
+
+    def __init__(self, ns_per_run: int):
+        self.ns_per_run = ns_per_run
+        self.run_counts = []
+
+    def timeit(self, run_count: int) -> int:
+        self.run_counts.append(run_count)
+        return run_count * self.ns_per_run
+
+
+class TestCalibrate:
+    def test_steps_up_to_target(self):
+        timer = FakeTimer(1_000)
+        assert calibrate(timer, target_ns=150_000, deadline=inf) == (200, 200_000)
+        assert timer.run_counts == [1, 2, 5, 10, 20, 50, 100, 200]
+
+    def test_stops_at_deadline(self):
+        timer = FakeTimer(1_000)
+        assert calibrate(timer, target_ns=10**12, deadline=0) == (1, 1_000)
+
+
+class TestRelativeMarginOfError:
+    def test_identical_samples(self):
+        assert relative_margin_of_error(10, 100, 1_000) == 0
+
+    def test_shrinks_with_more_samples(self):
+        few = relative_margin_of_error(4, 4 * 10, 2 * 9**2 + 2 * 11**2)
+        many = relative_margin_of_error(16, 16 * 10, 8 * 9**2 + 8 * 11**2)
+        assert many < few
+
+    @pytest.mark.parametrize("count, total", [(1, 10), (10, 0)])
+    def test_undefined(self, count, total):
+        assert relative_margin_of_error(count, total, 100) == inf
+
+
+class TestStats:
+    samples = [120, 100, 104, 98, 102, 96, 1_000, 101, 99, 103]
+
+    def test_summary_is_per_run(self):
+        stats = Stats.from_samples(self.samples, run_count=2)
+        assert stats.nanosec_sum == sum(self.samples)
+        assert stats.nanosec_avg == pytest.approx(statistics.mean(self.samples) / 2)
+        assert stats.median == pytest.approx(statistics.median(self.samples) / 2)
+        assert stats.variance == int(statistics.variance(self.samples) / 4)
+        assert stats.slowest == (500, 6)
+        assert stats.fastest == (48, 5)
+
+    def test_percentiles_match_linear_interpolation(self):
+        stats = Stats.from_samples(self.samples)
+        quantiles = statistics.quantiles(self.samples, n=100, method="inclusive")
+        for q, ns in stats.percentiles.items():
+            assert ns == pytest.approx(quantiles[q - 1])
+
+    def test_mad_and_outliers(self):
+        stats = Stats.from_samples(self.samples)
+        median = statistics.median(self.samples)
+        assert stats.mad == statistics.median(abs(sample - median) for sample in self.samples)
+        assert stats.outliers == 2  # 120 and 1,000 are beyond 1.5×IQR
+
+    def test_round_trip(self):
+        stats = Stats.from_samples(self.samples, run_count=10)
+        loaded = Stats.from_dict(stats.to_dict())
+        assert list(loaded.samples) == self.samples
+        assert (loaded.median, loaded.mad, loaded.percentiles) == (stats.median, stats.mad, stats.percentiles)
+
+    def test_empty(self):
+        stats = Stats.from_samples([])
+        assert not stats
+        assert stats.median is None
+        assert repr(stats) == "No samples"
+
+
+def test_percentile():
+    assert percentile([], 50) == 0.0
+    assert percentile([7], 99) == 7
+    assert percentile([0, 10], 25) == 2.5
+    assert percentile([1, 2, 3, 4], 100) == 4
+
+
+class TestMannWhitneyU:
+    def test_identical_samples(self):
+        assert mann_whitney_u([5] * 20, [5] * 20) == 1.0
+
+    def test_disjoint_samples(self):
+        assert mann_whitney_u(range(30), range(100, 130)) < 0.001
+
+    def test_interleaved_samples(self):
+        assert mann_whitney_u(range(0, 60, 2), range(1, 61, 2)) > 0.5
+
+    def test_empty_side(self):
+        assert mann_whitney_u([], [1, 2, 3]) == 1.0
+
+    def test_symmetric(self):
+        a, b = [1, 3, 5, 7, 9, 11], [2, 4, 4, 8, 20, 30]
+        assert mann_whitney_u(a, b) == pytest.approx(mann_whitney_u(b, a))
+
+
+class TestParseCell:
+    def test_lines_without_headers(self):
+        assert parse_cell("sorted(data)\n\nlist(data)\n") == (
+            {"sorted(data)": "sorted(data)", "list(data)": "list(data)"},
+            "pass",
+        )
+
+    def test_named_blocks_and_setup(self):
+        cell = "## setup\ndata = list(range(10))\n## loop\nfor x in data:\n    pass\n## builtin\nsum(data)\n"
+        candidates, setup = parse_cell(cell)
+        assert setup == "data = list(range(10))"
+        assert candidates == {"loop": "for x in data:\n    pass", "builtin": "sum(data)"}
+
+    def test_lines_before_first_header_are_ignored(self):
+        assert parse_cell("stray\n## only\nx + 1") == ({"only": "x + 1"}, "pass")
+
+
+IMPORTTIME_OUTPUT = """\
+import time: self [us] | cumulative | imported package
+import time:        10 |         10 |     _a
+import time:        20 |         20 |     _b
+import time:        30 |         60 |   pkg.sub
+import time:         5 |         65 | pkg
+import time:         7 |          7 | other
+"""
+
+
+class TestParseImporttime:
+    def test_tree(self):
+        roots = parse_importtime(IMPORTTIME_OUTPUT)
+        assert [root.name for root in roots] == ["pkg", "other"]
+        assert [(depth, node.name) for depth, node in roots[0].walk()] == [
+            (0, "pkg"),
+            (1, "pkg.sub"),
+            (2, "_a"),
+            (2, "_b"),
+        ]
+        assert (roots[0].self_us, roots[0].cumulative_us) == (5, 65)
+
+    def test_ignores_other_lines(self):
+        assert parse_importtime("hello\nTraceback (most recent call last):\n") == []
+
+
+class TestFitComplexity:
+    sizes = [10, 100, 1_000, 10_000]
+
+    def test_too_few_sizes(self):
+        assert fit_complexity([10, 100], [1.0, 2.0]) == []
+        assert fit_complexity([10, 10, 100], [1.0, 1.0, 2.0]) == []
+
+    def test_constant_prefers_simplest_model(self):
+        assert fit_complexity(self.sizes, [5.0, 5.01, 4.99, 5.0])[0].model == "O(1)"
+
+    @pytest.mark.parametrize(
+        "model, func",
+        [("O(n)", lambda n: 3 + 2 * n), ("O(n²)", lambda n: 1 + n * n), ("O(n log n)", lambda n: 2 + n * log2(n))],
+    )
+    def test_exact_growth(self, model, func):
+        best = fit_complexity(self.sizes, [func(n) for n in self.sizes])[0]
+        assert best.model == model
+        assert best(50_000) == pytest.approx(func(50_000), rel=1e-6)
+
+    def test_sweep_rejects_non_positive_sizes_before_measuring(self, capsys):
+        with pytest.raises(ValueError, match="at least 1"):
+            Sweep("sorted(range(n))", ("n", [0, 10, 100, 1000]))
+        assert capsys.readouterr().out == ""
+
+
+class TestResourceUsage:
+    @staticmethod
+    def usage(wall_ns: int, process_ns: int, probe_ns: int = 100) -> ResourceUsage:
+        before = (1_000, 5_000, 5_000, probe_ns // 2, None)
+        after = (1_000 + wall_ns, 5_000 + process_ns, 5_000 + process_ns, probe_ns // 2, None)
+        return ResourceUsage.between(before, after)
+
+    def test_cpu_bound(self):
+        usage = self.usage(wall_ns=10_000_000, process_ns=9_900_000)
+        assert usage.cpu_percent == pytest.approx(99)
+        assert usage.verdict == "CPU-bound"
+
+    def test_waiting(self):
+        usage = self.usage(wall_ns=10_000_000, process_ns=100_000)
+        assert usage.cpu_percent == pytest.approx(1)
+        assert usage.verdict == "waiting"
+
+    def test_window_too_short_for_the_probe(self):
+        usage = self.usage(wall_ns=2_000, process_ns=4_000, probe_ns=1_000)
+        assert usage.cpu_percent is None
+        assert usage.thread_percent is None
+        assert usage.verdict == "too short to tell"
+        assert "CPU: - " in str(usage)
+
+    def test_thread_never_exceeds_process_on_one_thread(self):
+        usage = Measurement("sum(range(10_000))", run_count=200).resources
+        assert usage.thread_ns <= usage.process_ns + usage.probe_ns  # Read a few ns apart, in the same order
+        assert usage.cpu_percent <= 100 + usage.probe_ns * 100 / usage.wall_ns
+
+
+def make_experiment(samples_by_run_count: dict[int, list[int]], variance=True, stmt="sorted(data)") -> Experiment:
+    """An Experiment as if it had measured `samples_by_run_count`, or only their totals if not `variance`."""
+    return Experiment.from_dict(
+        {
+            "stmt": stmt,
+            "setup": "pass",
+            "variance": variance,
+            "measurements": [
+                {
+                    "stmt": stmt,
+                    "run_count": run_count,
+                    "nanosec_sum": sum(samples) // len(samples),
+                    "nanosec_avg": sum(samples) / len(samples) / run_count,
+                    "margin_of_error": None,
+                    "stats": {"samples": array("q", samples).tobytes(), "run_count": run_count} if variance else None,
+                }
+                for run_count, samples in samples_by_run_count.items()
+            ],
+        }
+    )
+
+
+def noisy(center: float, spread: float, count=2_000, seed=0) -> list[int]:
+    rng = random.Random(seed)
+    return [int(rng.gauss(center, spread)) for _ in range(count)]
+
+
+class TestBaselineComparison:
+    def test_regression(self):
+        comparison = BaselineComparison(
+            make_experiment({10: noisy(10_000, 200)}), make_experiment({10: noisy(20_000, 400, seed=1)})
+        )
+        assert comparison.regressions == ["10"]
+        assert comparison
+
+    def test_improvement(self):
+        comparison = BaselineComparison(
+            make_experiment({10: noisy(10_000, 200)}), make_experiment({10: noisy(5_000, 100, seed=1)})
+        )
+        assert [verdict for *_, verdict in comparison.rows] == ["improvement"]
+        assert not comparison
+
+    def test_drift_within_the_noise_is_no_change(self):
+        # Thousands of samples per side make a 15% shift "significant" sample by sample; it's within the spread.
+        baseline, current = noisy(10_000, 3_000), noisy(8_500, 3_000, seed=1)
+        comparison = BaselineComparison(make_experiment({10: baseline}), make_experiment({10: current}))
+        assert [verdict for *_, verdict in comparison.rows] == ["no change"]
+
+    def test_without_samples(self):
+        comparison = BaselineComparison(
+            make_experiment({10: [10_000]}, variance=False), make_experiment({10: [20_000]}, variance=False)
+        )
+        assert comparison.rows[0][3:] == (None, "no verdict (no samples)")
+
+
+def test_history_round_trip(tmp_path):
+    experiment = make_experiment({10: noisy(10_000, 200), 100: noisy(100_000, 2_000)})
+    with History(tmp_path / "history.sqlite3") as history:
+        experiment_id = history.save(experiment)
+        baseline = history.baseline("sorted(data)")
+        assert history.baseline("sorted(other)") is None
+        assert [entry[0] for entry in history.entries("sorted(data)")] == [experiment_id]
+    assert baseline.runs_counts == [10, 100]
+    assert list(baseline["100"].stats.samples) == list(experiment["100"].stats.samples)
+    with pytest.raises(Exception, match="closed"):
+        history.entries()
+
+
+INNER = ("<timeit-src>", 6, "inner")
+DUMPS = ("/usr/lib/python3.11/json/__init__.py", 183, "dumps")
+ENCODE = ("/usr/lib/python3.11/json/encoder.py", 183, "encode")
+STACKS = Counter({(INNER, DUMPS, ENCODE): 3, (INNER, DUMPS): 1, (INNER,): 2})
+
+
+class TestHotspotsFromStacks:
+    def test_self_and_cumulative(self):
+        hotspots = Hotspots.from_stacks(STACKS, sample_ns=1_000)
+        rows = {row.function: (row.self_ns, row.cumulative_ns, row.calls) for row in hotspots}
+        assert rows == {
+            "inner (<timeit-src>:6)": (2_000, 6_000, None),
+            "dumps (__init__.py:183)": (1_000, 4_000, None),
+            "encode (encoder.py:183)": (3_000, 3_000, None),
+        }
+        assert hotspots[0].function == "encode (encoder.py:183)"
+
+    def test_round_trip(self):
+        hotspots = Hotspots.from_stacks(STACKS, sample_ns=1_000)
+        loaded = Hotspots.from_dict(json.loads(json.dumps(hotspots.to_dict())))
+        assert loaded.stacks == STACKS
+        assert loaded.rows == hotspots.rows
+
+
+class TestFlamegraphExport:
+    def test_folded_stacks(self):
+        profiles = {
+            "10 runs": Hotspots.from_stacks(STACKS, 1_000),
+            "a;b": Hotspots.from_stacks(Counter({(INNER,): 5}), 1),
+        }
+        assert folded_stacks(profiles).splitlines() == [
+            "10 runs;inner (<timeit-src>:6);dumps (__init__.py:183);encode (encoder.py:183) 3",
+            "10 runs;inner (<timeit-src>:6);dumps (__init__.py:183) 1",
+            "10 runs;inner (<timeit-src>:6) 2",
+            "a,b;inner (<timeit-src>:6) 5",
+        ]
+
+    def test_speedscope_profile(self):
+        profiles = {"10 runs": Hotspots.from_stacks(STACKS, 1_000), "100 runs": Hotspots.from_stacks(STACKS, 500)}
+        document = speedscope_profile(profiles, name="json.dumps(data)")
+        frames = document["shared"]["frames"]
+        assert [frame["name"] for frame in frames] == ["inner", "dumps", "encode"]
+        first, second = document["profiles"]
+        assert [[frames[i]["name"] for i in sample] for sample in first["samples"]] == [
+            ["inner", "dumps", "encode"],
+            ["inner", "dumps"],
+            ["inner"],
+        ]
+        assert first["weights"] == [3_000, 1_000, 2_000]
+        assert (first["endValue"], second["endValue"]) == (6_000, 3_000)
+        assert second["samples"] == first["samples"]  # Frames are shared across profiles
+
+    def test_experiment_flamegraph_writes_both_files(self, tmp_path, capsys):
+        experiment = make_experiment({10: [1_000] * 5})
+        experiment["10"].hotspots = Hotspots.from_stacks(STACKS, 1_000)
+        folded, speedscope = experiment.flamegraph(tmp_path / "sorted")
+        assert folded.read_text() == folded_stacks({"10 runs": experiment["10"].hotspots})
+        assert json.loads(speedscope.read_text())["name"] == "sorted(data)"
+
+
+class TestDrift:
+    def test_trend(self):
+        assert Drift([0.9, 1.0, 1.1]).trend == pytest.approx(0.2)
+        assert Drift([1.1, 1.0, 0.9, 1.0, 1.1]).trend == pytest.approx(0)
+        assert Drift([1.5]).trend == 0.0
+
+    def test_str(self):
+        assert str(Drift([])) == "Drift: no rounds"
+        assert str(Drift([0.9, 1.1])).startswith("Drift: +20.00% over 2 rounds")
+
+
+class WarmingTimer(FakeTimer):
+    """A FakeTimer that gets `step` slower (relatively) with every batch, like a CPU heating up."""
+
+    def __init__(self, ns_per_run: int, step: float):
+        super().__init__(ns_per_run)
+        self.step = step
+
+    def timeit(self, run_count: int) -> int:
+        return int(super().timeit(run_count) * (1 + self.step * len(self.run_counts)))
+
+
+class TestScheduler:
+    def test_rounds_after_warmup(self):
+        timers = {"a": FakeTimer(100), "b": FakeTimer(1_000)}
+        stats = Scheduler(timers, {"a": 10, "b": 2}, warmup=2).run(rounds=5)
+        assert [len(stats[name].samples) for name in "ab"] == [5, 5]
+        assert timers["a"].run_counts == [10] * 7
+        assert (stats["a"].median, stats["b"].median) == (100, 1_000)
+
+    def test_one_round_even_past_the_deadline(self):
+        scheduler = Scheduler({"a": FakeTimer(100)}, {"a": 1}, warmup=0)
+        assert len(scheduler.run(deadline=0)["a"].samples) == 1
+        assert len(scheduler.drift.factors) == 1
+
+    def test_no_rounds(self):
+        scheduler = Scheduler({"a": FakeTimer(100)}, {"a": 1})
+        assert not scheduler.run(rounds=0)["a"]
+        assert str(scheduler.drift) == "Drift: no rounds"
+
+    def test_stops_once_precise_enough(self):
+        scheduler = Scheduler({"a": FakeTimer(100), "b": FakeTimer(200)}, {"a": 1, "b": 1}, warmup=0)
+        stats = scheduler.run(deadline=10**20, rel_err=0.01, min_rounds=4)
+        assert len(stats["a"].samples) == 4
+
+    def test_drift_shared_by_all_jobs(self):
+        timers = {"a": WarmingTimer(100, step=0.01), "b": WarmingTimer(300, step=0.01)}
+        scheduler = Scheduler(timers, {"a": 1, "b": 1}, warmup=0)
+        scheduler.run(rounds=21)
+        assert scheduler.drift.trend == pytest.approx(
+            0.2 / 1.1, rel=0.02
+        )  # +20% over 21 rounds, relative to the middle
+
+
+class TestExperimentSlicing:
+    @staticmethod
+    def experiment() -> Experiment:
+        return make_experiment({run_count: [run_count * 100 + i for i in range(5)] for run_count in (1, 10, 100, 1000)})
+
+    def test_slice_is_a_view(self):
+        experiment = self.experiment()
+        view = experiment[1:3]
+        assert view.runs_counts == [10, 100]
+        assert list(view.measurements) == ["10", "100"]
+        assert view._measurements is experiment._measurements
+        assert view[0] is experiment[1]
+        assert view["100"] is experiment["100"]
+
+    def test_slice_of_a_slice(self):
+        experiment = self.experiment()
+        assert experiment[1:][::2].runs_counts == [10, 1000]
+        assert experiment[::-1][:2].runs_counts == [1000, 100]
+        assert len(experiment[1:][1:]) == 2
+
+    def test_columns_follow_the_rows(self):
+        view = self.experiment()[2:]
+        assert view.nanosec_avgs == [measurement.nanosec_avg for measurement in view.measurements.values()]
+        assert [stats.run_count for stats in view.stats_arr] == [100, 1000]
+
+    def test_full_experiment_sees_rows_added_later(self):
+        experiment = self.experiment()
+        view = experiment[:]
+        experiment._add(make_experiment({5: [500]})[0])
+        assert experiment.runs_counts == [1, 10, 100, 1000, 5]
+        assert view.runs_counts == [1, 10, 100, 1000]
+
+    def test_round_trip(self):
+        experiment = self.experiment()
+        loaded = Experiment.from_dict(experiment[1:3].to_dict())
+        assert loaded.runs_counts == [10, 100]
+        assert list(loaded["10"].stats.samples) == list(experiment["10"].stats.samples)